@@ -15,50 +15,141 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
+import functools
+import itertools
+import logging
 import multiprocessing
+import os
 import pickle
-from joblib import Parallel, delayed
+import shutil
+
+import numpy as np
+from src.Experiment.ExperimentGrid import GridCell, generation_key, uses_charge_fields, uses_fitness
+from src.Experiment.WorkerPool import GenerationPool, cell_tasks, imap_serial
 from src.Helpers.Division.ComputeDivision import SubMatrix
-from src.Individual.GenerativeIndividual import TrajectoryGeneration
-from src.Loaders.GenomePhenome import GenomeMeaning
+from src.Helpers.Fitness.ValueGraphFitness import load_fitness_landscape
+from src.Individual.GenerativeIndividual import TrajectoryGeneration, K
+from src.Loaders.GenomePhenome import GenomeMeaning, GENERATION_PROFILE
 from src.Loaders.LoadAPF import LoadAPF
 from src.Loaders.PlacesOnRoute import FindPlacesOnRoutes
 from src.Settings.args import args
-
-
-def worker_job_lib(individual, idx, random_seed):
-    """
-    Multiprocessing function that creates trajectories
-    :param individual: current object that generates
-    :param idx: index of the starting point
-    :param random_seed: random seed
-    :return: trajectories generated
-    """
-    distances, tra, real_tra, path = individual.create_trajectory(random_seed=random_seed, idx=idx)
-    return (distances, tra, real_tra, path)
+from src.Utils.SharedArrays import SharedArrayRegistry, attach_shared_arrays, shared_memory_available
+from src.Utils.Trajectory import to_real_points
 
 
 def save_data(vector_data, save_path, name, version):
     """
     Function that saves the data generated to disk
-    :param vector_data: data to save
+    :param vector_data: list of (points x 2) arrays of coordinates
     :param save_path: path where to save the data
     :param name: name of the file to save
     :param version: version of the file to save
     :return:
     """
-    all_real_points = []
-    for el in vector_data:
-        real_points = []
-        for point in el:
-            real_points.append(point.to_real_point())
-        all_real_points.append(real_points)
+    all_real_points = [to_real_points(coordinates=el) for el in vector_data]
     tra_path_real = "{}/{}_{}.pickle".format(save_path, name, version)
     pickle.dump(all_real_points, open(tra_path_real, 'wb'))
 
 
+def save_node_paths(paths, save_path, name, version):
+    """
+    Function that saves the paths as node ids of the road graph
+    All the paths are concatenated in one int32 array, offsets[i]:offsets[i + 1] is the i-th path
+    :param paths: list of arrays of node ids
+    :param save_path: path where to save the data
+    :param name: name of the file to save
+    :param version: version of the file to save
+    :return:
+    """
+    offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+    np.cumsum([len(el) for el in paths], out=offsets[1:])
+    nodes = np.concatenate(paths).astype(np.int32) if len(paths) > 0 else np.zeros(0, dtype=np.int32)
+    np.savez("{}/{}_{}.npz".format(save_path, name, version), nodes=nodes, offsets=offsets)
+
+
+def save_trajectories(trajectories, save_path, version):
+    """
+    Function that saves the trajectories generated (coordinates, resampled trajectory, path and node ids)
+    :param trajectories: iterable of Trajectory
+    :param save_path: where to save the data generated
+    :param version: version of the experiment
+    :return:
+    """
+    total_tra = []
+    # total_vector_distances = []
+    total_real_tra = []
+    total_paths = []
+    total_path_nodes = []
+    for trial in trajectories:
+        total_tra.append(trial.tra)
+        # total_vector_distances.append(trial.distances)
+        total_real_tra.append(trial.real)
+        total_paths.append(trial.path)
+        total_path_nodes.append(trial.path_nodes)
+
+    save_data(vector_data=total_real_tra, save_path=save_path, name="real_tra", version=version)
+    save_data(vector_data=total_tra, save_path=save_path, name="tra", version=version)
+    save_data(vector_data=total_paths, save_path=save_path, name="paths", version=version)
+    save_node_paths(paths=total_path_nodes, save_path=save_path, name="path_nodes", version=version)
+
+
+def link_trajectories(source_path, save_path, version):
+    """
+    Function that makes the trajectories saved by save_trajectories in source_path available in save_path
+    The files are hard linked, copied if the link is not possible
+    :param source_path: path where the data is saved
+    :param save_path: path where to link the data
+    :param version: version of the file to link
+    :return:
+    """
+    for name in ("real_tra_{}.pickle", "tra_{}.pickle", "paths_{}.pickle", "path_nodes_{}.npz"):
+        source = os.path.join(source_path, name.format(version))
+        destination = os.path.join(save_path, name.format(version))
+        if os.path.exists(destination):
+            os.remove(destination)
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+
+
+def load_node_paths(file_path):
+    """
+    Load the paths saved with save_node_paths
+    :param file_path: file to load
+    :return: list of arrays of node ids
+    """
+    with np.load(file_path) as data:
+        nodes = data["nodes"]
+        offsets = data["offsets"]
+    return [nodes[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def build_worker_individual(path_apf, name_exp, genomes, types_random_walk, fitness, max_distance,
+                            descriptors=None):
+    """
+    Load the data and build the generator inside a worker of the pool (start methods other than fork)
+    :param path_apf: path of the APF
+    :param name_exp: name of the experiment, used for the logger
+    :param genomes: genomes whose charge fields are precomputed, None if there are none
+    :param types_random_walk: random walks that are going to run
+    :param fitness: True if the fitness landscape is used
+    :param max_distance: longest distance to travel of the trajectories
+    :param descriptors: arrays published in shared memory by the parent process, None if there are none
+    :return: TrajectoryGeneration object
+    """
+    shared_arrays = attach_shared_arrays(descriptors=descriptors) if descriptors is not None else None
+    if fitness:
+        load_fitness_landscape(shared_arrays=shared_arrays, max_distance=max_distance)
+    controller = Controller(path_apf=path_apf, name_exp=name_exp, log=logging.getLogger(name_exp),
+                            shared_arrays=shared_arrays)
+    if genomes is not None:
+        controller.precompute_charge_fields(genomes=genomes, types_random_walk=types_random_walk)
+    return controller._get_individual()
+
+
 class Controller(object):
-    def __init__(self, path_apf, name_exp, log):
+    def __init__(self, path_apf, name_exp, log, shared_arrays=None):
         self._path_apf = path_apf
         self._name_exp = name_exp
         self._logger = log
@@ -68,21 +159,48 @@ class Controller(object):
         # load the controller and assign it to the generator
         # random position and taac, generate tra and save it
         self._list_genome = None
+        self._precomputed_genomes = None
+        # random walks that are going to run and longest distance to travel
+        self._types_random_walk = [args.type_random_walk]
+        self._max_distance = args.total_distance_to_travel
 
         self._loader_apf = LoadAPF(path=self._path_apf, logger=self._logger)
-        self._loader_apf.load_apf_only_routing_system()
+        self._loader_apf.load_apf_metadata()
         self._loader_apf.match_index_with_coordinates()
+        if shared_arrays is not None and "step_lengths" in shared_arrays:
+            self._loader_apf.step_lengths = shared_arrays["step_lengths"]
         self._loader_genome_meaning = GenomeMeaning(logger=self._logger)
-        self._loader_genome_meaning.load_data(test=False)
+        self._loader_genome_meaning.load_data(test=False, profile=GENERATION_PROFILE)
 
         self._sub_matrix = SubMatrix(log=self._logger,
                                      list_points=self._loader_genome_meaning.name_typologies,
-                                     values_matrix=(self._loader_apf.x_values, self._loader_apf.y_values))
+                                     values_matrix=(self._loader_apf.x_values, self._loader_apf.y_values),
+                                     shared_arrays=shared_arrays)
         self._sub_matrix.divide_into_cells()
 
         self._pre_loaded_points = FindPlacesOnRoutes(logger=self._logger)
         self._pre_loaded_points.load_preloaded_position()
 
+        # built on the first run and kept for all the genomes
+        self._individual = None
+        self._pool = None
+        self._shared_arrays = None
+
+    def precompute_charge_fields(self, genomes, types_random_walk=None):
+        """
+        Compute the charge fields of all the genomes that are going to be tested in one pass
+        Only the weighted random walks (types 2 to 5) use them
+        :param genomes: list of genomes
+        :param types_random_walk: random walks that are going to run, None for the one of the command line
+        :return:
+        """
+        if types_random_walk is not None:
+            self._types_random_walk = list(types_random_walk)
+        if uses_charge_fields(types_random_walk=self._types_random_walk):
+            self._logger.debug("Computing charge fields of {} genomes".format(len(genomes)))
+            self._sub_matrix.load_charge_field_bank(genomes=genomes, K=K)
+            self._precomputed_genomes = genomes
+
     def set_vector_data(self, vector_data):
         """
         Read data from file and load the controller
@@ -91,6 +209,127 @@ class Controller(object):
         """
         self._list_genome = vector_data
 
+    def _get_individual(self):
+        """
+        Return the generator, built the first time
+        The data it uses does not depend on the genome, only the genome changes between runs
+        :return: TrajectoryGeneration object
+        """
+        if self._individual is None:
+            values_matrix = (self._loader_apf.x_values, self._loader_apf.y_values)
+            self._individual = TrajectoryGeneration(values_matrix=values_matrix,
+                                                    apf=self._loader_apf,
+                                                    pre_matrix=self._sub_matrix,
+                                                    type_of_generator=args.type_random_walk,
+                                                    pre_loaded_points=self._pre_loaded_points,
+                                                    total_distance_to_travel=args.total_distance_to_travel,
+                                                    step_lengths=self._loader_apf.step_lengths)
+        return self._individual
+
+    def _get_pool(self, how_many):
+        """
+        Return the pool of workers, started the first time
+        The workers receive the generator once, the charge fields have to be precomputed before the first run
+        :param how_many: how many trajectories the first run generates
+        :return: GenerationPool object
+        """
+        if self._pool is None:
+            if self._uses_fitness():
+                # loaded (rasters built if missing) once here, the forked workers inherit it
+                load_fitness_landscape(max_distance=self._max_distance)
+            self._pool = GenerationPool(individual=self._get_individual(), factory=None,
+                                        processes=max(1, min(multiprocessing.cpu_count(), how_many)))
+            if self._pool.start_method != "fork":
+                # the forked workers share the memory of the parent, the others attach to the derived arrays
+                descriptors = self._publish_shared_arrays()
+                self._pool.factory = functools.partial(build_worker_individual, path_apf=self._path_apf,
+                                                       name_exp=self._name_exp, genomes=self._precomputed_genomes,
+                                                       types_random_walk=self._types_random_walk,
+                                                       fitness=self._uses_fitness(), max_distance=self._max_distance,
+                                                       descriptors=descriptors)
+            self._logger.debug("Starting {} workers ({})".format(self._pool.processes, self._pool.start_method))
+            self._pool.start()
+        return self._pool
+
+    def _uses_fitness(self):
+        return uses_fitness(types_random_walk=self._types_random_walk)
+
+    def _publish_shared_arrays(self):
+        """
+        Publish in shared memory the arrays built by the parent process, the workers attach to them instead of
+        building their own copy. Arrays memory mapped from disk are already shared
+        :return: descriptors of the arrays, None if shared memory is not available
+        """
+        if not shared_memory_available():
+            return None
+        self._shared_arrays = SharedArrayRegistry()
+        self._sub_matrix.publish_arrays(registry=self._shared_arrays)
+        self._shared_arrays.publish(name="step_lengths", array=self._loader_apf.step_lengths)
+        if self._uses_fitness():
+            load_fitness_landscape(max_distance=self._max_distance).publish(registry=self._shared_arrays)
+        self._logger.debug("{} arrays in shared memory ({} MB)".format(len(self._shared_arrays),
+                                                                      self._shared_arrays.nbytes // 2 ** 20))
+        return self._shared_arrays.descriptors()
+
+    def close(self):
+        """
+        Stop the workers and free the shared memory
+        :return:
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        if self._shared_arrays is not None:
+            self._shared_arrays.close()
+            self._shared_arrays = None
+
+    def run_grid(self, cells, how_many, version="0", debug=False):
+        """
+        Generate the trajectories of all the cells of the experiment grid
+        The chunks of all the cells go through the same pool of workers, the results of a cell are saved as soon as
+        they are all generated. Cells whose trajectories do not depend on what differs between them (the genome for
+        the random walks 0 and 1) are generated once and linked in the other folders
+        :param cells: list of (where to save the data generated, GridCell)
+        :param how_many: how many trajectories to generate per cell
+        :param version: version of the experiment
+        :param debug: True if debug in single core is necessary, False multiprocessing is on
+        :return:
+        """
+        # cells generating the same trajectories (random walks not using the genome) run once
+        groups = []
+        position_of_key = {}
+        for save_path, cell in cells:
+            key = generation_key(cell=cell)
+            if key in position_of_key:
+                groups[position_of_key[key]][2].append(save_path)
+            else:
+                position_of_key[key] = len(groups)
+                groups.append((save_path, cell, []))
+        if len(groups) < len(cells):
+            self._logger.debug("{} cells generate the same trajectories of others, {} to generate".format(
+                len(cells) - len(groups), len(groups)))
+
+        to_generate = [cell for _, cell, _ in groups]
+        if self._pool is None:
+            self._max_distance = max([self._max_distance] + [cell.total_distance_to_travel for cell in to_generate])
+        if uses_fitness(types_random_walk=[cell.type_random_walk for cell in to_generate]):
+            # rasters covering the longest trajectories of the grid
+            load_fitness_landscape(max_distance=max(cell.total_distance_to_travel for cell in to_generate))
+        if debug:
+            # serial execution
+            tasks = cell_tasks(cells=to_generate, how_many=how_many, batch_size=args.batch_size, processes=1)
+            results = imap_serial(individual=self._get_individual(), tasks=tasks)
+        else:
+            results = self._get_pool(how_many=how_many * len(to_generate)).imap_cells(cells=to_generate,
+                                                                                      how_many=how_many,
+                                                                                      batch_size=args.batch_size)
+        for save_path, cell, same_trajectories in groups:
+            self._logger.debug("Generating Trajectories of {}".format(save_path))
+            save_trajectories(trajectories=itertools.islice(results, how_many), save_path=save_path, version=version)
+            for other_path in same_trajectories:
+                link_trajectories(source_path=save_path, save_path=other_path, version=version)
+        self._logger.debug("Trajectories generated")
+
     def initialise_individual_and_run(self, save_path, how_many, version="0", debug=False, random_seed=42):
         """
         Initialise the generator, run it using all the processors in the cpu
@@ -102,40 +341,8 @@ class Controller(object):
         :param random_seed: random seed
         :return:
         """
-        individual = TrajectoryGeneration(
-                                          genotype=self._list_genome,
-                                          values_matrix=(self._loader_apf.x_values, self._loader_apf.y_values),
-                                          apf=self._loader_apf.apf,
-                                          pre_matrix=self._sub_matrix,
-                                          type_of_generator=args.type_random_walk,
-                                          pre_loaded_points=self._pre_loaded_points,
-                                          total_distance_to_travel=args.total_distance_to_travel)
-
-        self._logger.debug("Generating Trajectories")
-        results = []
-        number_of_processes = multiprocessing.cpu_count()
-        if how_many < number_of_processes:
-            number_of_processes = how_many
-        if debug:
-            # serial execution
-            number_of_processes = 1
-        with Parallel(n_jobs=number_of_processes, verbose=30) as parallel:
-            res = parallel(delayed(worker_job_lib)(individual, i, random_seed) for i in range(how_many))
-            results.append(res)
-
-        # distances, tra, real_tra, path, preloaded_points
-        total_tra = []
-        # total_vector_distances = []
-        total_real_tra = []
-        total_paths = []
-        for trial in results[0]:
-            total_tra.append(trial[1])
-            # total_vector_distances.append(trial[0])
-            total_real_tra.append(trial[2])
-            total_paths.append(trial[3])
-
-        save_data(vector_data=total_real_tra, save_path=save_path, name="real_tra", version=version)
-        save_data(vector_data=total_tra, save_path=save_path, name="tra", version=version)
-        save_data(vector_data=total_paths, save_path=save_path, name="paths", version=version)
-
-        self._logger.debug("Trajectories generated")
+        # one cell grid with the settings of the command line
+        cell = GridCell(genome=self._list_genome, type_random_walk=args.type_random_walk,
+                        point_distance=args.point_distance, random_seed=random_seed,
+                        total_distance_to_travel=args.total_distance_to_travel)
+        self.run_grid(cells=[(save_path, cell)], how_many=how_many, version=version, debug=debug)
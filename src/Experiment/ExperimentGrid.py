@@ -0,0 +1,150 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import collections
+import itertools
+import json
+
+from src.Helpers.Fitness.ValueGraphFitness import load_fitness_landscape
+from src.Settings.args import args
+
+# settings of one run of the generator, the grid is the product of the values of every field
+GridCell = collections.namedtuple("GridCell", ["genome", "type_random_walk", "point_distance", "random_seed",
+                                               "total_distance_to_travel"])
+# random walks that do not use the genome
+GENOME_INDEPENDENT_TYPES = (0, 1)
+# name of the fields in the folder of a cell
+FOLDER_NAMES = {"type_random_walk": "type", "point_distance": "point_distance", "random_seed": "seed",
+                "total_distance_to_travel": "distance"}
+
+
+def uses_charge_fields(types_random_walk):
+    """
+    Check if the charge fields are needed: only the weighted random walks (types 2 to 5) use them
+    :param types_random_walk: random walks that are going to run
+    :return: True if at least one of them uses the charge fields
+    """
+    return any(type_random_walk >= 2 for type_random_walk in types_random_walk)
+
+
+def uses_fitness(types_random_walk):
+    """
+    Check if the fitness landscape is needed: only the fitness random walks (types 4 and 5) use it
+    :param types_random_walk: random walks that are going to run
+    :return: True if at least one of them uses the fitness landscape
+    """
+    return any(type_random_walk >= 4 for type_random_walk in types_random_walk)
+
+
+def apply_cell(individual, cell):
+    """
+    Set the generator for the cell of the grid
+    :param individual: TrajectoryGeneration object
+    :param cell: GridCell
+    :return:
+    """
+    individual.configure(type_of_generator=cell.type_random_walk,
+                         total_distance_to_travel=cell.total_distance_to_travel)
+    individual.genome = cell.genome
+    if uses_fitness(types_random_walk=[cell.type_random_walk]):
+        landscape = load_fitness_landscape(max_distance=cell.total_distance_to_travel)
+        landscape.set_point_distance(point_distance=cell.point_distance)
+
+
+def generation_key(cell):
+    """
+    Settings the trajectories of the cell depend on, cells with the same key generate the same trajectories
+    The genome is used only by the weighted random walks and the point distance only by the fitness ones
+    :param cell: GridCell
+    :return: hashable key
+    """
+    genome = tuple(cell.genome) if cell.type_random_walk not in GENOME_INDEPENDENT_TYPES else None
+    point_distance = None
+    if uses_fitness(types_random_walk=[cell.type_random_walk]) and cell.point_distance is not None:
+        point_distance = tuple(cell.point_distance)
+    return genome, cell.type_random_walk, point_distance, cell.random_seed, cell.total_distance_to_travel
+
+
+class ExperimentGrid(object):
+    """
+    Grid of experiments: every combination of genome, random walk, fitness point distance, seed and distance to
+    travel is one cell, generated in its own folder
+    Values not given are the ones of the command line
+    """
+
+    def __init__(self, genomes, types_random_walk=None, point_distances=None, random_seeds=None, distances=None):
+        self.genomes = [list(genome) for genome in genomes]
+        self.types_random_walk = types_random_walk if types_random_walk is not None else [args.type_random_walk]
+        self.point_distances = point_distances if point_distances is not None else [args.point_distance]
+        self.random_seeds = random_seeds if random_seeds is not None else [args.random_seed]
+        self.distances = distances if distances is not None else [args.total_distance_to_travel]
+        for value in self.types_random_walk:
+            if value not in range(6):
+                raise ValueError("type of random walk {} not implemented".format(value))
+
+    def __len__(self):
+        return len(self.genomes) * len(self.types_random_walk) * len(self.point_distances) * \
+            len(self.random_seeds) * len(self.distances)
+
+    def cells(self, name="generate_tra_per_force"):
+        """
+        Expand the grid, the genome changes slowest
+        The folder of a cell is the one of the sweep over the genomes (name_version_N) plus the value of the other
+        fields that have more than one value
+        :param name: first part of the name of the folders
+        :return: list of (folder name, GridCell)
+        """
+        varying = [field for field, values in (("type_random_walk", self.types_random_walk),
+                                               ("point_distance", self.point_distances),
+                                               ("random_seed", self.random_seeds),
+                                               ("total_distance_to_travel", self.distances)) if len(values) > 1]
+        cells = []
+        for version, genome in enumerate(self.genomes):
+            for values in itertools.product(self.types_random_walk, self.point_distances, self.random_seeds,
+                                            self.distances):
+                cell = GridCell(genome, *values)
+                folder = "{}_version_{}".format(name, version)
+                for field in varying:
+                    value = getattr(cell, field)
+                    if isinstance(value, (list, tuple)):
+                        value = "-".join(str(el) for el in value)
+                    folder += "_{}_{}".format(FOLDER_NAMES[field], value)
+                cells.append((folder, cell))
+        return cells
+
+
+def load_grid(name_file, genomes):
+    """
+    Load the grid from a json file with the lists of values of the fields
+    (genomes, type_random_walk, point_distance, random_seed, total_distance_to_travel), all optional
+    :param name_file: json file, None to use only the command line values
+    :param genomes: genomes used if the file does not list them
+    :return: ExperimentGrid
+    """
+    definition = {}
+    if name_file is not None:
+        with open(name_file) as handle:
+            definition = json.load(handle)
+    unknown = set(definition) - {"genomes", "type_random_walk", "point_distance", "random_seed",
+                                 "total_distance_to_travel"}
+    if len(unknown) > 0:
+        raise ValueError("Unknown fields in the grid: {}".format(sorted(unknown)))
+    return ExperimentGrid(genomes=definition.get("genomes", genomes),
+                          types_random_walk=definition.get("type_random_walk"),
+                          point_distances=definition.get("point_distance"),
+                          random_seeds=definition.get("random_seed"),
+                          distances=definition.get("total_distance_to_travel"))
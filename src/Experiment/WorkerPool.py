@@ -0,0 +1,324 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import functools
+import multiprocessing
+import queue
+import time
+
+from src.Experiment.ExperimentGrid import apply_cell
+from src.RandomWalk.PointGenerator import PointGenerator
+
+# generator used by the tasks of the pool, set once per process by the initializer
+_individual = None
+# generator the forked workers inherit from the parent
+_parent_individual = None
+# error raised by the initializer, reported by the tasks (a failing initializer would restart the workers forever)
+_initialisation_error = None
+
+
+def default_start_method():
+    """
+    Start method of the pool
+    fork shares the data already loaded by the parent copy-on-write, forkserver is the next best preloading method
+    :return: name of the start method
+    """
+    available = multiprocessing.get_all_start_methods()
+    for method in ("fork", "forkserver"):
+        if method in available:
+            return method
+    return "spawn"
+
+
+def _initialise_worker(factory=None):
+    """
+    Initializer of the workers, run once per process
+    :param factory: function building the generator in the worker, None if the generator is inherited with fork
+    :return:
+    """
+    global _individual, _initialisation_error
+    try:
+        _individual = factory() if factory is not None else _parent_individual
+    except Exception as error:
+        _initialisation_error = error
+
+
+def _get_individual():
+    if _individual is None:
+        raise ValueError("Worker not initialised: {!r}".format(_initialisation_error))
+    return _individual
+
+
+def worker_job_cell(cell, idxs, random_seed, batched):
+    """
+    Task of the pool that creates trajectories of one cell of the experiment grid
+    :param cell: GridCell
+    :param idxs: indexes of the starting points
+    :param random_seed: random seed
+    :param batched: True to use the batched random walk
+    :return: list of trajectories generated and seconds spent
+    """
+    start = time.perf_counter()
+    individual = _get_individual()
+    apply_cell(individual=individual, cell=cell)
+    if batched:
+        trajectories = individual.create_trajectories(random_seed=random_seed, idxs=idxs)
+    else:
+        trajectories = [individual.create_trajectory(random_seed=random_seed, idx=idx) for idx in idxs]
+    return trajectories, time.perf_counter() - start
+
+
+class ChunkSizer(object):
+    """
+    Size of the next chunk of starting indexes
+    The cost of a trajectory changes a lot with the start (walks stopping at dead ends, fitness walks slowing down
+    while growing), so the size comes from the time measured per trajectory: chunks last about target_seconds, and
+    near the end they get smaller so that the workers finish together
+    """
+
+    def __init__(self, processes, target_seconds=1.0, max_size=256, smoothing=0.3):
+        self._processes = processes
+        self._target_seconds = target_seconds
+        self._max_size = max_size
+        self._smoothing = smoothing
+        # moving average of the seconds per trajectory, None before the first measure
+        self.seconds_per_task = None
+
+    def record(self, tasks, seconds):
+        """
+        Add the time measured for a chunk
+        :param tasks: trajectories in the chunk
+        :param seconds: seconds spent by the worker
+        :return:
+        """
+        if tasks == 0:
+            return
+        measure = seconds / tasks
+        if self.seconds_per_task is None:
+            self.seconds_per_task = measure
+        else:
+            self.seconds_per_task += self._smoothing * (measure - self.seconds_per_task)
+
+    def next_size(self, remaining):
+        """
+        Size of the next chunk
+        :param remaining: starting indexes not dispatched yet
+        :return: int size, at least 1
+        """
+        if self.seconds_per_task is None:
+            # first chunks of single trajectories, to measure the cost
+            return 1
+        size = int(self._target_seconds / max(self.seconds_per_task, 1e-6))
+        # the last chunks split the work left among the workers
+        size = min(size, self._max_size, remaining // (2 * self._processes))
+        return max(1, size)
+
+
+def adaptive_tasks(function, idxs, sizer, first_argument, other_arguments):
+    """
+    Tasks over chunks of starting indexes sized by the sizer, generated lazily so every size uses the times measured
+    up to that moment
+    :param function: task of the pool, called with the first argument, the chunk and the other arguments
+    :param idxs: indexes of the starting points
+    :param sizer: ChunkSizer
+    :param first_argument: argument of the task before the chunk
+    :param other_arguments: tuple of arguments of the task after the chunk
+    :return: iterator of (function, arguments, sizer)
+    """
+    idxs = list(idxs)
+    dispatched = 0
+    while dispatched < len(idxs):
+        size = sizer.next_size(remaining=len(idxs) - dispatched)
+        chunk = idxs[dispatched:dispatched + size]
+        dispatched += len(chunk)
+        yield function, (first_argument, chunk) + tuple(other_arguments), sizer
+
+
+def cell_tasks(cells, how_many, batch_size, processes, target_seconds=1.0):
+    """
+    Tasks generating how_many trajectories for every cell of the experiment grid, same chunks of
+    Controller.initialise_individual_and_run: fixed chunks for the batched random walks, adaptive ones otherwise.
+    The cells with the same random walk and distance share the measured times
+    :param cells: list of GridCell
+    :param how_many: trajectories per cell
+    :param batch_size: walkers moving together with the batched random walk, 0 disables it
+    :param processes: number of workers
+    :param target_seconds: time every chunk should last
+    :return: iterator of (function, arguments, sizer)
+    """
+    sizers = {}
+    for cell in cells:
+        if batch_size > 0 and PointGenerator(typology_needed=cell.type_random_walk, pre_matrix=None).supports_batch():
+            for start in range(0, how_many, batch_size):
+                idxs = list(range(start, min(start + batch_size, how_many)))
+                yield worker_job_cell, (cell, idxs, cell.random_seed, True), None
+        else:
+            key = (cell.type_random_walk, cell.total_distance_to_travel)
+            if key not in sizers:
+                sizers[key] = ChunkSizer(processes=processes, target_seconds=target_seconds)
+            for task in adaptive_tasks(function=worker_job_cell, idxs=range(how_many), sizer=sizers[key],
+                                       first_argument=cell, other_arguments=(cell.random_seed, False)):
+                yield task
+
+
+def imap_serial(individual, tasks):
+    """
+    Run the tasks of the pool one after the other in this process
+    :param individual: generator used by the tasks
+    :param tasks: iterator of (function, arguments, sizer)
+    :return: iterator of trajectories, same order of the tasks
+    """
+    global _individual
+    _individual = individual
+    for function, arguments, sizer in tasks:
+        trajectories, seconds = function(*arguments)
+        if sizer is not None:
+            sizer.record(tasks=len(trajectories), seconds=seconds)
+        for trajectory in trajectories:
+            yield trajectory
+
+
+def _put_result(finished, position, result):
+    finished.put((position, result, None))
+
+
+def _put_error(finished, position, error):
+    finished.put((position, None, error))
+
+
+class GenerationPool(object):
+    """
+    Long-lived pool of processes generating trajectories
+    The generator (with the data it uses) reaches every worker once, when the worker starts: with fork it is inherited
+    copy-on-write, otherwise the initializer calls the factory, which loads the data (memory mapped where possible)
+    in the worker. Tasks carry only the cell of the experiment grid (genome and settings), the starting indexes and
+    the seed, so the same pool serves all the cells of an experiment
+    """
+
+    def __init__(self, individual, factory, processes=None, start_method=None):
+        self._individual = individual
+        self.factory = factory
+        self.processes = processes if processes is not None else multiprocessing.cpu_count()
+        self.start_method = start_method if start_method is not None else default_start_method()
+        self._pool = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    @property
+    def running(self):
+        return self._pool is not None
+
+    def start(self):
+        """
+        Start the workers, the data has to be loaded before calling it
+        :return:
+        """
+        global _parent_individual
+        if self._pool is not None:
+            return
+        context = multiprocessing.get_context(self.start_method)
+        if self.start_method == "fork":
+            _parent_individual = self._individual
+            initargs = (None,)
+        else:
+            initargs = (self.factory,)
+        self._pool = context.Pool(processes=self.processes, initializer=_initialise_worker, initargs=initargs)
+
+    def imap_tasks(self, tasks):
+        """
+        Dispatch the tasks dynamically: a new task is sent when a worker returns one, at most two per worker are
+        waiting, so the fast workers take more chunks and there is no long tail
+        :param tasks: iterator of (function, arguments, ChunkSizer recording the time or None), every function
+                      returns a list of trajectories and the seconds spent
+        :return: iterator of trajectories, same order of the tasks
+        """
+        self.start()
+        tasks = iter(tasks)
+        finished = queue.Queue()
+        ready = {}
+        sizers = {}
+        number_of_tasks = 0
+        to_yield = 0
+        while True:
+            while len(sizers) < 2 * self.processes:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                function, arguments, sizer = task
+                self._pool.apply_async(function, arguments,
+                                       callback=functools.partial(_put_result, finished, number_of_tasks),
+                                       error_callback=functools.partial(_put_error, finished, number_of_tasks))
+                sizers[number_of_tasks] = sizer
+                number_of_tasks += 1
+            if len(sizers) == 0:
+                return
+            position, result, error = finished.get()
+            sizer = sizers.pop(position)
+            if error is not None:
+                raise error
+            trajectories, seconds = result
+            if sizer is not None:
+                sizer.record(tasks=len(trajectories), seconds=seconds)
+            ready[position] = trajectories
+            while to_yield in ready:
+                for trajectory in ready.pop(to_yield):
+                    yield trajectory
+                to_yield += 1
+
+    def imap_cells(self, cells, how_many, batch_size, target_seconds=1.0):
+        """
+        Generate the trajectories of all the cells of the experiment grid, the cells share the workers
+        :param cells: list of GridCell
+        :param how_many: trajectories per cell
+        :param batch_size: walkers moving together with the batched random walk, 0 disables it
+        :param target_seconds: time every adaptive chunk should last
+        :return: iterator of trajectories, how_many per cell in the order of the cells
+        """
+        return self.imap_tasks(tasks=cell_tasks(cells=cells, how_many=how_many, batch_size=batch_size,
+                                                processes=self.processes, target_seconds=target_seconds))
+
+    def close(self):
+        """
+        Wait for the workers to finish and stop them
+        :return:
+        """
+        global _parent_individual
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        _parent_individual = None
+
+    def terminate(self):
+        """
+        Stop the workers immediately
+        :return:
+        """
+        global _parent_individual
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        _parent_individual = None
@@ -0,0 +1,141 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import os
+
+import numpy as np
+
+from src.Helpers.Road.RoadGraph import NO_NODE
+from src.Settings.args import args
+
+MAX_NEIGHBOURS = 8
+
+
+def build_alias_tables(indptr, weights):
+    """
+    Build the alias table of every node at the same time (Vose method, vectorised over the nodes)
+    The probability of moving from a node to its k-th neighbour is weights[indptr[node] + k] over the sum of the
+    weights of the node. Nodes with all weights equal to zero move uniformly
+    The temporaries are float32 and uint8 (nodes x 8), build big graphs in blocks of nodes
+    :param indptr: CSR pointers of the road graph (or of a block of its nodes)
+    :param weights: weight of every edge
+    :return: probability and alias (position among the neighbours) of every edge
+    """
+    degrees = np.diff(indptr).astype(np.int32)
+    positions = np.arange(MAX_NEIGHBOURS, dtype=np.int32)
+    valid = positions < degrees[:, None]
+    padded = np.zeros(valid.shape, dtype=np.float32)
+    padded[valid] = weights
+
+    totals = padded.sum(axis=1)
+    no_weight = totals <= 0
+    padded[no_weight] = valid[no_weight]
+    totals[no_weight] = degrees[no_weight]
+    # scaled probabilities, average 1 over the neighbours of every node
+    scaled = padded
+    scaled /= np.maximum(totals, np.finfo(np.float32).tiny)[:, None]
+    scaled *= degrees[:, None]
+
+    probabilities = np.ones(valid.shape, dtype=np.float32)
+    aliases = np.tile(positions.astype(np.uint8), (len(degrees), 1))
+    remaining = valid.copy()
+    rows = np.arange(len(degrees), dtype=np.int32)
+    for _ in range(MAX_NEIGHBOURS - 1):
+        # pair the smallest remaining entry with the largest one, the last remaining keeps probability 1
+        working = remaining.sum(axis=1) > 1
+        if not working.any():
+            break
+        small = np.argmin(np.where(remaining, scaled, np.float32(np.inf)), axis=1)[working]
+        large = np.argmax(np.where(remaining, scaled, np.float32(-np.inf)), axis=1)[working]
+        working_rows = rows[working]
+        probabilities[working_rows, small] = scaled[working_rows, small]
+        aliases[working_rows, small] = large
+        scaled[working_rows, large] -= 1 - scaled[working_rows, small]
+        remaining[working_rows, small] = False
+    return probabilities[valid], aliases[valid]
+
+
+class AliasTable(object):
+    """
+    Transition tables of the weighted random walk for one genome
+    Moving out of a node depends only on the node and the charge of its neighbours,
+    so every step is one uniform draw and one lookup in the table
+    """
+
+    def __init__(self, graph, key):
+        self._graph = graph
+        self._indptr = graph.indptr
+        self._indices = graph.indices
+        self.key = key
+        self.probabilities = None
+        self.aliases = None
+
+    def compute(self, charge_field, nodes_per_block=1000000):
+        """
+        Build the tables of all the nodes, a block of nodes every time
+        :param charge_field: charge of every road node
+        :param nodes_per_block: how many nodes to build every time
+        :return:
+        """
+        number_of_nodes = self._graph.number_of_nodes
+        self.probabilities = np.zeros(len(self._indices), dtype=np.float32)
+        self.aliases = np.zeros(len(self._indices), dtype=np.uint8)
+        for start in range(0, number_of_nodes, nodes_per_block):
+            end = min(start + nodes_per_block, number_of_nodes)
+            edges = slice(self._indptr[start], self._indptr[end])
+            self.probabilities[edges], self.aliases[edges] = build_alias_tables(
+                indptr=self._indptr[start:end + 1], weights=charge_field[self._indices[edges]])
+
+    def load_or_compute(self, charge_field, cache=True, folder="charge_fields"):
+        """
+        Load the tables from disk if already built, otherwise build them (and store them if cache is True)
+        :param charge_field: charge of every road node
+        :param cache: True if the tables have to be stored on disk
+        :param folder: folder inside the data path where the tables are stored, next to the charge fields
+        :return:
+        """
+        name_file = "{}/{}/alias_{}.npz".format(args.data_path, folder, self.key)
+        if cache and os.path.isfile(name_file):
+            with np.load(name_file) as stored:
+                self.probabilities = stored["probabilities"]
+                self.aliases = stored["aliases"]
+            return
+        self.compute(charge_field=charge_field)
+        if cache:
+            os.makedirs(os.path.dirname(name_file), exist_ok=True)
+            # written under a temporary name, a run killed halfway does not leave broken tables
+            with open(name_file + ".tmp", "wb") as handle:
+                np.savez(handle, probabilities=self.probabilities, aliases=self.aliases)
+            os.replace(name_file + ".tmp", name_file)
+
+    def sample(self, node, uniform):
+        """
+        Choose the next node
+        :param node: current node
+        :param uniform: random value in [0, 1)
+        :return: next node id, NO_NODE if the node has no neighbours
+        """
+        first_edge = self._indptr[node]
+        degree = self._indptr[node + 1] - first_edge
+        if degree == 0:
+            return NO_NODE
+        value = uniform * degree
+        position = int(value)
+        edge = first_edge + position
+        if value - position >= self.probabilities[edge]:
+            position = self.aliases[edge]
+        return int(self._indices[first_edge + position])
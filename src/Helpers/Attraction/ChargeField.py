@@ -0,0 +1,178 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from src.Settings.args import args
+from src.Utils.SharedArrays import is_memory_mapped
+
+
+def charge_field_key(genome, K, number_of_nodes):
+    """
+    Key identifying the charge field of a genome
+    :param genome: multiplier for the attraction
+    :param K: constant for the computation of the charge
+    :param number_of_nodes: nodes of the road graph
+    :return: string hash
+    """
+    hash_function = hashlib.sha1()
+    hash_function.update(np.asarray(genome, dtype=np.float64).tobytes())
+    hash_function.update(np.float64(K).tobytes())
+    hash_function.update(np.int64(number_of_nodes).tobytes())
+    return hash_function.hexdigest()[:16]
+
+
+class ChargeField(object):
+    """
+    Total charge of every road node for one genome
+    Same value of SubMatrix.return_charge_from_point, computed once for all the nodes of the road graph,
+    so the weighted random walks read the charge of the neighbours with one gather
+    """
+
+    def __init__(self, pre_matrix, genome, K):
+        self._pre_matrix = pre_matrix
+        self._genome = np.asarray(genome, dtype=np.float64)
+        self._K = K
+        self.key = charge_field_key(genome=genome, K=K, number_of_nodes=pre_matrix.road_graph.number_of_nodes)
+        self.values = None
+
+    def compute(self, nodes_per_block=1000000):
+        """
+        Compute the charge of all the nodes, reading the distances in blocks of nodes
+        :param nodes_per_block: how many nodes to read every time
+        :return:
+        """
+        graph = self._pre_matrix.road_graph
+        self.values = np.zeros(graph.number_of_nodes, dtype=np.float32)
+        for start in range(0, graph.number_of_nodes, nodes_per_block):
+            nodes = np.arange(start, min(start + nodes_per_block, graph.number_of_nodes))
+            xs, ys = graph.coordinates(ids=nodes)
+            distances = self._pre_matrix.return_distances_for_points(xs=xs, ys=ys)
+            self.values[nodes] = np.sum(distances * self._genome * self._K, axis=1)
+
+    def load_or_compute(self, cache=True, folder="charge_fields"):
+        """
+        Load the field from disk if already computed, otherwise compute it (and store it if cache is True)
+        :param cache: True if the field has to be stored on disk
+        :param folder: folder inside the data path where the fields are stored
+        :return:
+        """
+        name_file = "{}/{}/charge_{}.npy".format(args.data_path, folder, self.key)
+        if cache and os.path.isfile(name_file):
+            self.values = np.load(name_file, mmap_mode='r')
+            return
+        self.compute()
+        if cache:
+            os.makedirs(os.path.dirname(name_file), exist_ok=True)
+            # written under a temporary name, a run killed halfway does not leave a broken field
+            np.save(name_file + ".tmp.npy", self.values)
+            os.replace(name_file + ".tmp.npy", name_file)
+
+
+class ChargeFieldBank(object):
+    """
+    Charge fields of many genomes computed together
+    The distances of a block of nodes (nodes x tags) are read once and multiplied by the matrix of all the genomes
+    (tags x genomes). The result is a (genomes x nodes) float32 memmap that later runs can reuse
+    """
+
+    def __init__(self, pre_matrix, genomes, K):
+        self._pre_matrix = pre_matrix
+        self._genomes = np.asarray(genomes, dtype=np.float64)
+        self.K = K
+        self._rows = {tuple(genome): i for i, genome in enumerate(self._genomes.tolist())}
+        self.key = charge_field_key(genome=self._genomes, K=K, number_of_nodes=pre_matrix.road_graph.number_of_nodes)
+        self.values = None
+
+    def __contains__(self, genome):
+        return tuple(np.asarray(genome, dtype=np.float64).tolist()) in self._rows
+
+    def compute(self, name_file=None, nodes_per_block=250000):
+        """
+        Compute the charge of all the nodes for all the genomes
+        Memory used is bounded by the block size: the result goes in a memmap if name_file is given
+        :param name_file: npy file where to write the result, None to keep it in memory
+        :param nodes_per_block: how many nodes to read every time
+        :return:
+        """
+        graph = self._pre_matrix.road_graph
+        shape = (len(self._genomes), graph.number_of_nodes)
+        if name_file is not None:
+            self.values = np.lib.format.open_memmap(name_file, mode='w+', dtype=np.float32, shape=shape)
+        else:
+            self.values = np.zeros(shape, dtype=np.float32)
+        genomes_matrix = self._genomes.T * self.K
+        for start in range(0, graph.number_of_nodes, nodes_per_block):
+            nodes = np.arange(start, min(start + nodes_per_block, graph.number_of_nodes))
+            xs, ys = graph.coordinates(ids=nodes)
+            distances = self._pre_matrix.return_distances_for_points(xs=xs, ys=ys)
+            self.values[:, start:start + len(nodes)] = np.dot(distances, genomes_matrix).T
+        if name_file is not None:
+            self.values.flush()
+
+    def load_or_compute(self, cache=True, folder="charge_fields"):
+        """
+        Load the fields from disk if already computed, otherwise compute them (on disk if cache is True)
+        :param cache: True if the fields have to be stored on disk
+        :param folder: folder inside the data path where the fields are stored
+        :return:
+        """
+        name_file = "{}/{}/bank_{}.npy".format(args.data_path, folder, self.key)
+        if cache and os.path.isfile(name_file):
+            self.values = np.load(name_file, mmap_mode='r')
+            return
+        if cache:
+            os.makedirs(os.path.dirname(name_file), exist_ok=True)
+            # written under a temporary name, a run killed halfway does not leave a broken bank
+            self.compute(name_file=name_file + ".tmp.npy")
+            self.values = None
+            os.replace(name_file + ".tmp.npy", name_file)
+            self.values = np.load(name_file, mmap_mode='r')
+        else:
+            self.compute()
+
+    def publish(self, registry):
+        """
+        Publish the fields in shared memory, if they are not memory mapped from disk
+        :param registry: SharedArrayRegistry
+        :return:
+        """
+        if not is_memory_mapped(self.values):
+            registry.publish(name="charge_field_bank/{}".format(self.key), array=self.values)
+
+    def load_shared(self, arrays):
+        """
+        If the fields are among the shared arrays, use them
+        :param arrays: dict name -> array attached from shared memory, None if there are not
+        :return: True if the fields are loaded, False otherwise
+        """
+        name = "charge_field_bank/{}".format(self.key)
+        if arrays is None or name not in arrays:
+            return False
+        self.values = arrays[name]
+        return True
+
+    def get(self, genome):
+        """
+        Return the charge field of one genome
+        :param genome: multiplier for the attraction
+        :return: float32 array, one value per node of the road graph
+        """
+        return self.values[self._rows[tuple(np.asarray(genome, dtype=np.float64).tolist())]]
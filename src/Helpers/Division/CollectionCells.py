@@ -15,23 +15,118 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-import numpy as np
-
 import os
-
 import pickle
 
+import numpy as np
+
+from src.Loaders.DataBundle import load_data_bundle
 from src.Settings.args import args
 
+# (i, j) offsets of the eight neighbour cells
+CELL_NEIGHBOURS_OFFSET = np.array([[-1, 0], [-1, 1], [0, 1], [1, 1], [1, 0], [1, -1], [0, -1], [-1, -1]],
+                                  dtype=np.int16)
+
+
+def cells_to_arrays(list_cells):
+    """
+    Convert the dict of HugeCell into the arrays stored by CollectionCells
+    Cells keep the order of the dict, that is also their position in the memory mapped data
+    :param list_cells: dict id -> HugeCell
+    :return: dict of arrays
+    """
+    cells = list(list_cells.values())
+    number_of_features = len(cells[0]._points) if len(cells) > 0 else 0
+    ids = np.array([[int(el) for el in cell.id.split("-")] for cell in cells], dtype=np.int16).reshape(-1, 2)
+    bounds = np.array([cell.get_border_matrix() for cell in cells], dtype=np.int32).reshape(-1, 4)
+    boxes = np.array([cell._polygon.bounds for cell in cells], dtype=np.float64).reshape(-1, 4)
+    points = []
+    counts = []
+    for cell in cells:
+        for feature in range(number_of_features):
+            objects = cell.get_list_item(index=feature)
+            counts.append(len(objects))
+            points.extend(list(pos.coords)[0] for pos in objects)
+    point_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=point_offsets[1:])
+    return {"ids": ids, "bounds": bounds, "boxes": boxes, "number_of_features": np.int64(number_of_features),
+            "point_offsets": point_offsets, "points": np.array(points, dtype=np.float64).reshape(-1, 2)}
+
+
+def convert_pickled_cells(pickle_file, npz_file):
+    """
+    Convert a pickled dict of HugeCell into the npz loaded by CollectionCells
+    :param pickle_file: pickle to read
+    :param npz_file: npz to write
+    :return:
+    """
+    with open(pickle_file, 'rb') as handle:
+        list_cells = pickle.load(handle)
+    # written under a temporary name, a conversion killed halfway is done again the next time
+    with open(npz_file + ".tmp", 'wb') as handle:
+        np.savez(handle, **cells_to_arrays(list_cells=list_cells))
+    os.replace(npz_file + ".tmp", npz_file)
+
 
 class CollectionCells(object):
+    """
+    Division of the matrix in cells, stored as arrays with one row per cell
+    ids: (i, j) position of the cell in the division
+    bounds: min x, max x, min y, max y of the cell in matrix coordinates (max excluded)
+    boxes: min x, min y, max x, max y of the cell in real coordinates
+    points: real coordinates of all the objects, the objects of feature f in cell c are
+    points[point_offsets[c * number_of_features + f]:point_offsets[c * number_of_features + f + 1]]
+    The row of a cell is also its position in the memory mapped data
+    """
+
     def __init__(self, x_division, y_division, save_and_store=True):
-        self._list_cells = {}
         self._x_division = x_division
         self._y_division = y_division
         self._save_and_store = save_and_store
         self.max_values = None
         self.min_values = None
+        self.indexing = None
+        self.data = None
+        self.ids = None
+        self.bounds = None
+        self.boxes = None
+        self.centroids = None
+        self.number_of_features = 0
+        self.point_offsets = None
+        self.points = None
+        self.cell_index = None
+        self._x_starts = None
+        self._y_starts = None
+
+    def __len__(self):
+        return 0 if self.ids is None else len(self.ids)
+
+    def _name_file(self, name):
+        return "{}/{}_{}_by_{}".format(args.data_path, name, self._x_division, self._y_division)
+
+    def _set_arrays(self, arrays):
+        """
+        Set the arrays of the cells and derive the lookup tables
+        :param arrays: dict of arrays (see cells_to_arrays)
+        :return:
+        """
+        self.ids = arrays["ids"]
+        self.bounds = arrays["bounds"]
+        self.boxes = arrays["boxes"]
+        self.number_of_features = int(arrays["number_of_features"])
+        self.point_offsets = arrays["point_offsets"]
+        self.points = arrays["points"]
+        self.centroids = np.stack(((self.boxes[:, 0] + self.boxes[:, 2]) / 2,
+                                   (self.boxes[:, 1] + self.boxes[:, 3]) / 2), axis=1)
+
+        # row of every cell, from its (i, j) position
+        self.cell_index = np.full((self.ids[:, 0].max() + 1, self.ids[:, 1].max() + 1), -1, dtype=np.int16)
+        self.cell_index[self.ids[:, 0], self.ids[:, 1]] = np.arange(len(self.ids))
+        # first matrix coordinate of every column and row of cells
+        self._x_starts = np.full(self.cell_index.shape[0], np.iinfo(np.int32).max, dtype=np.int64)
+        np.minimum.at(self._x_starts, self.ids[:, 0], self.bounds[:, 0])
+        self._y_starts = np.full(self.cell_index.shape[1], np.iinfo(np.int32).max, dtype=np.int64)
+        np.minimum.at(self._y_starts, self.ids[:, 1], self.bounds[:, 2])
 
     def store_current_list_cells(self, name="division_cell_list"):
         """
@@ -40,88 +135,86 @@ class CollectionCells(object):
         :return:
         """
         if self._save_and_store:
-            # if self._list_cells[0].has_point():
-            # i have something in the cells
-            root = os.path.dirname(os.path.abspath(__file__))
-            output_folder = root.replace("Helpers", "Data")
-            name_file = "{}_{}_by_{}".format(name, self._x_division, self._y_division)
-            pickle.dump(self._list_cells, open("{}/{}.pickle".format(output_folder, name_file), 'wb'))
+            npz_file = "{}.npz".format(self._name_file(name=name))
+            with open(npz_file + ".tmp", 'wb') as handle:
+                np.savez(handle, ids=self.ids, bounds=self.bounds, boxes=self.boxes,
+                         number_of_features=np.int64(self.number_of_features), point_offsets=self.point_offsets,
+                         points=self.points)
+            os.replace(npz_file + ".tmp", npz_file)
 
     def load_stored_list_cells(self, name="division_cell_list"):
         """
         If the file is present, load the data from store instead that from file
+        The old pickled dict of cells is converted to npz the first time it is found
         :param name: name to load
         :return: return True if loaded is complete, otherwise False
         """
         if not self._save_and_store:
             return False
-        name_file = "{}_{}_by_{}_dict_version".format(name, self._x_division, self._y_division)
-        if os.path.isfile("{}/{}.pickle".format(args.data_path, name_file)):
-            self._list_cells = pickle.load(open("{}/{}.pickle".format(args.data_path, name_file), 'rb'))
-            return True
-        return False
-
-    def get_all_cells(self):
+        name_file = self._name_file(name=name)
+        if not os.path.isfile("{}.npz".format(name_file)):
+            pickle_file = "{}_dict_version.pickle".format(name_file)
+            if not os.path.isfile(pickle_file):
+                return False
+            convert_pickled_cells(pickle_file=pickle_file, npz_file="{}.npz".format(name_file))
+        with np.load("{}.npz".format(name_file)) as data:
+            self._set_arrays(arrays=data)
+        return True
+
+    def find_cells_from_matrix_coord(self, xs, ys):
         """
-        return list of all the cells
-        :return: list of cells
+        Return the cells containing the points given in matrix coordinates
+        :param xs: array of x matrix coordinates
+        :param ys: array of y matrix coordinates
+        :return: int array of cell rows, -1 if the point is not inside any cell
         """
-        return self._list_cells
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        i = np.clip(np.searchsorted(self._x_starts, xs, side='right') - 1, 0, len(self._x_starts) - 1)
+        j = np.clip(np.searchsorted(self._y_starts, ys, side='right') - 1, 0, len(self._y_starts) - 1)
+        cells = self.cell_index[i, j]
+        bounds = self.bounds[cells]
+        inside = (cells >= 0) & (bounds[:, 0] <= xs) & (xs < bounds[:, 1]) & (bounds[:, 2] <= ys) & (ys < bounds[:, 3])
+        return np.where(inside, cells, -1)
 
     def find_current_cell_from_matrix_coord(self, point):
         """
-        return id cell given point in matrix coordinate
+        return the cell given point in matrix coordinate
         :param point: point inside cell
-        :return: id of the cell
+        :return: row of the cell, None if the point is not inside any cell
         """
-        for cell in self._list_cells:
-            if cell.is_inside_cell(point=point):
-                return cell.id
+        cell = int(self.find_cells_from_matrix_coord(xs=[point.x], ys=[point.y])[0])
+        return None if cell < 0 else cell
 
-    def from_id_get_neighbours(self, current_id):
+    def neighbours_of_cell(self, cell):
         """
-        return id of the heighbours of the current cell
-        :return:
+        return the neighbours of the cell
+        :param cell: row of the cell
+        :return: int array with the rows of the neighbour cells
+        """
+        positions = self.ids[cell].astype(np.int64) + CELL_NEIGHBOURS_OFFSET
+        inside = np.all((positions >= 0) & (positions < self.cell_index.shape), axis=1)
+        neighbours = self.cell_index[positions[inside, 0], positions[inside, 1]]
+        return neighbours[neighbours >= 0]
+
+    def counts(self):
+        """
+        return how many objects of every feature every cell has
+        :return: int matrix (cells x features)
+        """
+        return np.diff(self.point_offsets).reshape(-1, self.number_of_features)
+
+    def get_cell_points(self, cell, feature):
+        """
+        return the objects of one feature inside the cell
+        :param cell: row of the cell
+        :param feature: index of the feature
+        :return: real coordinates of the objects (objects x 2)
         """
-        neighbours_ids = []
-        int_i_id = int(current_id.split("-")[0])
-        int_j_id = int(current_id.split("-")[1])
-        if int_i_id - 1 >= 0:
-            neighbours_ids.append("{}-{}".format(int_i_id - 1, int_j_id))
-        if int_i_id - 1 >= 0 and int_j_id + 1 <= self._y_division:
-            neighbours_ids.append("{}-{}".format(int_i_id - 1, int_j_id + 1))
-        if int_j_id + 1 <= self._y_division:
-            neighbours_ids.append("{}-{}".format(int_i_id, int_j_id + 1))
-        if int_i_id + 1 <= self._x_division and int_j_id + 1 <= self._y_division:
-            neighbours_ids.append("{}-{}".format(int_i_id + 1, int_j_id + 1))
-        if int_i_id + 1 <= self._x_division:
-            neighbours_ids.append("{}-{}".format(int_i_id + 1, int_j_id))
-        if int_i_id + 1 <= self._x_division and int_j_id - 1 >= 0:
-            neighbours_ids.append("{}-{}".format(int_i_id + 1, int_j_id - 1))
-        if int_j_id - 1 >= 0:
-            neighbours_ids.append("{}-{}".format(int_i_id, int_j_id - 1))
-        if int_i_id - 1 >= 0 and int_j_id - 1 >= 0:
-            neighbours_ids.append("{}-{}".format(int_i_id - 1, int_j_id - 1))
-        return neighbours_ids
-
-    def get_cell_from_id(self, id):
-        """
-        return the cell with the right id
-        :param id: id to find
-        :return: cell
-        """
-        return self._list_cells[id]
+        position = cell * self.number_of_features + feature
+        return self.points[self.point_offsets[position]:self.point_offsets[position + 1]]
 
     def load_mmap_data(self):
-        name_file = "{}/cell_data_to_mmap.dat".format(args.data_path)
-        data_input = np.memmap(name_file, dtype='float32', mode='r', shape=(154, 155, 6, 2, 1600))
-        count = 0
-        for k, cell in self._list_cells.items():
-            cell.matrix = data_input
-            cell.index = count
-            count += 1
-
-        name_file = "{}/indexing_fast.dat".format(args.data_path)
-        ndexing = np.memmap(name_file, dtype='int16', mode='r', shape=(6159, 6083, 2))
-        for k, cell in self._list_cells.items():
-            cell._indexing = ndexing
+        bundle = load_data_bundle()
+        self.data = bundle.open(name="cell_data")
+        self.indexing = bundle.open(name="indexing")
@@ -16,24 +16,42 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import sys
+from collections import OrderedDict
 
-from haversine import haversine
 import numpy as np
+
+from src.Helpers.Attraction.AliasTable import AliasTable
+from src.Helpers.Attraction.ChargeField import ChargeField, ChargeFieldBank, charge_field_key
 from src.Helpers.Division.CollectionCells import CollectionCells
-from src.Settings.args import args
+from src.Helpers.Road.NeighbourMask import NeighbourMask, road_from_indexing
+from src.Helpers.Road.RoadGraph import RoadGraph
+from src.Loaders.DataBundle import load_data_bundle
+from src.Utils.GreatCircle import haversine_array
+from src.Utils.Point import Point
+from src.Utils.VisitedSet import VisitedNodes
+
+# transition tables of the weighted random walk kept in memory by every process
+ALIAS_TABLES_IN_MEMORY = 4
 
 
 class SubMatrix(object):
-    def __init__(self, log, list_points, values_matrix, save_and_store=True):
+    def __init__(self, log, list_points, values_matrix, save_and_store=True, shared_arrays=None):
         self._log = log
         self._list_points = list_points
         self._list_of_cells = None
         self._match_key_index = None
+        self.neighbour_mask = None
+        self.road_graph = None
+        self._charge_field = None
+        self._charge_field_bank = None
+        self._alias_tables = OrderedDict()
+        self._visited_nodes = None
         self._save_and_store = save_and_store
         self._values_matrix = values_matrix
+        # arrays attached from the shared memory of the parent process, used instead of loading or building them
+        self._shared_arrays = shared_arrays
 
-        name_file = "{}/matrix_id_matrix_mmap.dat".format(args.data_path)
-        self._coordinate_index = np.memmap(name_file, dtype='int8', mode='r', shape=(6159, 6201, 2))
+        self._coordinate_index = load_data_bundle().open(name="matrix_id")
 
     def divide_into_cells(self, x_division=40, y_division=40):
         """
@@ -65,6 +83,23 @@ class SubMatrix(object):
             self._log.debug("Point division loaded from file")
 
         self._list_of_cells.load_mmap_data()
+
+        # the stored mask and graph are rebuilt if the indexing matrix changes
+        source = load_data_bundle().signature(name="indexing")
+        self.neighbour_mask = NeighbourMask(log=self._log)
+        if not self.neighbour_mask.load_shared(arrays=self._shared_arrays) and \
+                not self.neighbour_mask.load_stored(source=source):
+            self.neighbour_mask.build_from_indexing(indexing=self._list_of_cells.indexing)
+            if self._save_and_store:
+                self.neighbour_mask.store(source=source)
+
+        self.road_graph = RoadGraph(log=self._log)
+        if not self.road_graph.load_shared(arrays=self._shared_arrays) and \
+                not self.road_graph.load_stored(source=source):
+            self.road_graph.build(road=road_from_indexing(indexing=self._list_of_cells.indexing),
+                                  mask=self.neighbour_mask.mask)
+            if self._save_and_store:
+                self.road_graph.store(source=source)
         #
         # # for performance support
         self._log = None
@@ -79,51 +114,59 @@ class SubMatrix(object):
         :param current_position: position we are now
         :return: float minimum distance to object
         """
-        current_cell_id = self._list_of_cells.find_current_cell_from_matrix_coord(point=current_position)
-
-        neighbors_ids = self._list_of_cells.from_id_get_neighbours(current_id=current_cell_id)
-        neighbors_ids.append(current_cell_id)
-
-        all_the_distances = []
-        for i in range(len(self._match_key_index.keys())):
-            all_the_distances.append({"min_value_distace": sys.float_info.max, "equation_precomputed_value": 0})
-
-        for cell in self._list_of_cells.get_all_cells():
-            if cell.id in neighbors_ids:
-                index_vector = 0
-                for key, value in self._match_key_index.items():
-                    # get position all the points
-                    vector_points = cell.get_list_item(index=value)
-                    if len(vector_points) > 0:
-                        # compute distances from current poiunt from them all
-                        distances = [haversine((self._values_matrix[0][int(current_position.x)],
-                                                self._values_matrix[1][int(current_position.y)]),
-                                               list(pos.coords)[0]) * 1000
-                                     for pos in vector_points]
-                        # compute distances squared
-                        distances_updated = [1 / (el * el) for el in distances]
-
-                        all_the_distances[index_vector]["min_value_distace"] = \
-                            min(all_the_distances[index_vector]["min_value_distace"], min(distances))
-                        all_the_distances[index_vector]["equation_precomputed_value"] += sum(distances_updated)
-                    index_vector += 1
-            else:
-                # only one charge per cell
-                centroid_cell = cell.get_centroid()[0]
-                distance = haversine((self._values_matrix[0][int(current_position.x)],
-                                      self._values_matrix[1][int(current_position.y)]), centroid_cell) * 1000
-                distance_updated = 1 / (distance * distance)
-                index_vector = 0
-                for key, value in self._match_key_index.items():
-                    number_of_elements = len(cell.get_list_item(index=value))
-
-                    all_the_distances[index_vector]["min_value_distace"] = \
-                        min(all_the_distances[index_vector]["min_value_distace"], distance)
-                    all_the_distances[index_vector]["equation_precomputed_value"] += (
-                            number_of_elements * distance_updated)
-                    index_vector += 1
+        min_distances, equations = self.precompute_minimum_distances_and_equations(xs=[int(current_position.x)],
+                                                                                   ys=[int(current_position.y)])
+        all_the_distances = [{"min_value_distace": float(min_distance), "equation_precomputed_value": float(equation)}
+                             for min_distance, equation in zip(min_distances[0], equations[0])]
         return {"distances_per_tag": all_the_distances}
 
+    def precompute_minimum_distances_and_equations(self, xs, ys, positions_per_block=4096):
+        """
+        Vectorised version of precompute_minimum_distance_and_equation for many positions
+        Objects in the cell of the position and in its neighbour cells count one by one,
+        every other cell counts as all its objects placed in its centroid
+        :param xs: array of x matrix coordinates
+        :param ys: array of y matrix coordinates
+        :param positions_per_block: how many positions to compute every time
+        :return: minimum distance and sum of the inverse squared distances, matrices (positions x tags)
+        """
+        cells = self._list_of_cells
+        number_of_features = len(self._match_key_index.keys())
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        positions = np.stack((np.asarray(self._values_matrix[0])[xs], np.asarray(self._values_matrix[1])[ys]), axis=1)
+        current_cells = cells.find_cells_from_matrix_coord(xs=xs, ys=ys)
+        counts = cells.counts()[:, :number_of_features]
+
+        min_distances = np.full((len(xs), number_of_features), sys.float_info.max, dtype=np.float64)
+        equations = np.zeros((len(xs), number_of_features), dtype=np.float64)
+        for start in range(0, len(xs), positions_per_block):
+            block = slice(start, start + positions_per_block)
+            # distance to the centroid of every cell (positions x cells)
+            centroid_distances = haversine_array(positions[block][:, None], cells.centroids[None]) * 1000
+            near = np.zeros(centroid_distances.shape, dtype=bool)
+            for cell in np.unique(current_cells[block]):
+                if cell < 0:
+                    continue
+                members = np.flatnonzero(current_cells[block] == cell)
+                near_cells = np.append(cells.neighbours_of_cell(cell=cell), cell)
+                near[members[:, None], near_cells] = True
+                # objects of the near cells, one by one
+                for feature in range(number_of_features):
+                    points = np.concatenate([cells.get_cell_points(cell=el, feature=feature) for el in near_cells])
+                    if len(points) == 0:
+                        continue
+                    distances = haversine_array(positions[block][members][:, None], points[None]) * 1000
+                    rows = start + members
+                    min_distances[rows, feature] = np.minimum(min_distances[rows, feature], distances.min(axis=1))
+                    equations[rows, feature] += np.sum(1 / (distances * distances), axis=1)
+
+            # far cells, one charge per cell
+            far_distances = np.where(near, np.inf, centroid_distances)
+            min_distances[block] = np.minimum(min_distances[block], far_distances.min(axis=1)[:, None])
+            equations[block] += np.dot(1 / (far_distances * far_distances), counts)
+        return min_distances, equations
+
     def return_distance_from_point(self, current_position):
         """
         from the current position return the distance to the closest point
@@ -131,13 +174,98 @@ class SubMatrix(object):
         :param current_position: current position
         :return: vector of distances per tag
         """
-        raw_id_cell = self._coordinate_index[current_position.x][current_position.y]
-        id_current_cell = "{}-{}".format(raw_id_cell[0], raw_id_cell[1])
-        cell = self._list_of_cells.get_cell_from_id(id=id_current_cell)
+        return self.return_distances_for_points(xs=[current_position.x], ys=[current_position.y])[0].tolist()
+
+    def return_distances_for_points(self, xs, ys):
+        """
+        Vectorised version of return_distance_from_point
+        The cell of every point, its position inside the cell and the distances are read with fancy indexing,
+        one read per memory mapped matrix for all the points
+        :param xs: array of x matrix coordinates
+        :param ys: array of y matrix coordinates
+        :return: matrix (points x tags) of distances
+        """
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        raw_id_cells = self._coordinate_index[xs, ys]
+        cells = self._list_of_cells.cell_index[raw_id_cells[:, 0], raw_id_cells[:, 1]]
+        values = self._list_of_cells.indexing[xs, ys]
+        features = np.arange(len(self._match_key_index.keys()))
+        return self._list_of_cells.data[values[:, 0, None], values[:, 1, None], features, 0, cells[:, None]]
+
+    def load_charge_field_bank(self, genomes, K):
+        """
+        Compute (or load from disk) the charge fields of all the genomes in one pass over the distances
+        :param genomes: list of genomes
+        :param K: constant for the computation of the charge
+        :return:
+        """
+        self._charge_field_bank = ChargeFieldBank(pre_matrix=self, genomes=genomes, K=K)
+        if not self._charge_field_bank.load_shared(arrays=self._shared_arrays):
+            self._charge_field_bank.load_or_compute(cache=self._save_and_store)
+
+    def publish_arrays(self, registry):
+        """
+        Publish in shared memory the arrays derived from the data that are not memory mapped from disk
+        (neighbour mask, road graph and charge fields bank)
+        :param registry: SharedArrayRegistry
+        :return:
+        """
+        self.neighbour_mask.publish(registry=registry)
+        self.road_graph.publish(registry=registry)
+        if self._charge_field_bank is not None:
+            self._charge_field_bank.publish(registry=registry)
+
+    def get_charge_field(self, genome, K):
+        """
+        Return the charge of every road node for the genome given
+        Genomes in the bank are read from it, otherwise the last field used is kept in memory
+        and the fields are cached on disk
+        :param genome: multiplier for the attraction
+        :param K: constant for the computation of the charge
+        :return: float32 array, one value per node of the road graph
+        """
+        if self._charge_field_bank is not None and self._charge_field_bank.K == K and \
+                genome in self._charge_field_bank:
+            return self._charge_field_bank.get(genome=genome)
+        key = charge_field_key(genome=genome, K=K, number_of_nodes=self.road_graph.number_of_nodes)
+        if self._charge_field is None or self._charge_field.key != key:
+            self._charge_field = ChargeField(pre_matrix=self, genome=genome, K=K)
+            self._charge_field.load_or_compute(cache=self._save_and_store)
+        return self._charge_field.values
+
+    def get_alias_table(self, genome, K):
+        """
+        Return the transition tables of the weighted random walk for the genome given
+        The last ALIAS_TABLES_IN_MEMORY tables used are kept in memory, and the tables are cached on disk
+        next to the charge fields
+        :param genome: multiplier for the attraction
+        :param K: constant for the computation of the charge
+        :return: AliasTable
+        """
+        key = charge_field_key(genome=genome, K=K, number_of_nodes=self.road_graph.number_of_nodes)
+        if key in self._alias_tables:
+            self._alias_tables.move_to_end(key)
+            return self._alias_tables[key]
+        alias_table = AliasTable(graph=self.road_graph, key=key)
+        alias_table.load_or_compute(charge_field=self.get_charge_field(genome=genome, K=K),
+                                    cache=self._save_and_store)
+        self._alias_tables[key] = alias_table
+        if len(self._alias_tables) > ALIAS_TABLES_IN_MEMORY:
+            self._alias_tables.popitem(last=False)
+        return alias_table
 
-        vector_distances = [cell.return_value_min_distance(point=[current_position.x, current_position.y],
-                                                           index=i) for i in range(len(self._match_key_index.keys()))]
-        return vector_distances
+    def get_visited_nodes(self):
+        """
+        Return an empty set of visited nodes for a new trajectory
+        The same set is reused by all the trajectories generated by this process
+        :return: VisitedNodes
+        """
+        if self._visited_nodes is None:
+            self._visited_nodes = VisitedNodes(number_of_nodes=self.road_graph.number_of_nodes)
+        else:
+            self._visited_nodes.reset()
+        return self._visited_nodes
 
     def return_charge_from_point(self, current_position, genome, K):
         """
@@ -159,13 +287,18 @@ class SubMatrix(object):
         :param points: list of points to check
         :return: list of points from the input list that are actually on a route
         """
-        points_on_street = []
-        for p in points:
-            # id_current_cell = self._list_of_cells.find_current_cell_from_matrix_coord(point=p)
-            # optimised way with mmeap
-            raw_id_cell = self._coordinate_index[p.x][p.y]
-            id_current_cell = "{}-{}".format(raw_id_cell[0], raw_id_cell[1])
-            cell = self._list_of_cells.get_cell_from_id(id=id_current_cell)
-            if cell.check_if_on_a_road(point=p):
-                points_on_street.append(p)
-        return points_on_street
+        if len(points) == 0:
+            return []
+        on_street = self._list_of_cells.indexing[[p.x for p in points], [p.y for p in points], 0] != 0
+        return [p for p, road in zip(points, on_street) if road]
+
+    def neighbours_on_street(self, point):
+        """
+        Return the neighbours of the point that are on a route
+        Same result of list_neighbours followed by keep_only_points_on_street, with only one read of the
+        neighbour mask
+        :param point: current point
+        :return: list of points
+        """
+        xs, ys = self.neighbour_mask.neighbours(x=point.x, y=point.y)
+        return [Point(x, y) for x, y in zip(xs.tolist(), ys.tolist())]
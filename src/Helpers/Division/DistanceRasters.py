@@ -0,0 +1,225 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+
+import numpy as np
+from scipy import ndimage
+
+from src.Loaders.GenomePhenome import GenomeMeaning
+from src.Loaders.LoadAPF import LoadAPF
+from src.Settings.args import args
+from src.Utils.GreatCircle import haversine_array
+
+
+def _mmap_objects(genome_meaning, name):
+    """
+    Objects of one feature in the memory mapped layout: one padded row of name_and_position per tag,
+    order_name_and_position gives the row of every tag (list of tags or dict tag -> row)
+    :param genome_meaning: loaded GenomeMeaning with the mmap method
+    :param name: name of the feature
+    :return: list of arrays (objects x 2), one per tag of the feature
+    """
+    if genome_meaning.name_and_details is None:
+        raise ValueError("The tags of the features are released, load GenomeMeaning with performance=False")
+    order = genome_meaning.order_name_and_position
+    if not isinstance(order, dict):
+        order = {tag: row for row, tag in enumerate(order)}
+    rows = {str(tag).lower(): row for tag, row in order.items()}
+    tags = [tag for tag in genome_meaning.name_and_details[name] if tag in rows]
+    if len(tags) == 0:
+        raise ValueError("No tag of {} in the memory mapped positions".format(name))
+    objects = []
+    for tag in tags:
+        values = np.asarray(genome_meaning.name_and_position[rows[tag]])
+        # the rows are padded, the padding is not a finite position or it is (0, 0)
+        real = np.isfinite(values).all(axis=1) & (values != 0).any(axis=1)
+        objects.append(values[real].astype(np.float64))
+    return objects
+
+
+def positions_per_feature(genome_meaning):
+    """
+    Collect the real coordinates of the objects of every feature, from the csv files or from the memory mapped file
+    :param genome_meaning: loaded GenomeMeaning
+    :return: list of arrays (objects x 2), same order of name_typologies
+    """
+    positions = []
+    for name in genome_meaning.name_typologies:
+        if genome_meaning.method_mmap:
+            objects = _mmap_objects(genome_meaning=genome_meaning, name=name)
+        else:
+            objects = [np.asarray(values, dtype=np.float64).reshape(-1, 2)
+                       for values in genome_meaning.name_and_position[name].values()]
+        positions.append(np.concatenate(objects) if len(objects) > 0 else np.zeros((0, 2), dtype=np.float64))
+    return positions
+
+
+def rasterise_positions(positions, x_values, y_values):
+    """
+    Mark the cells of the grid containing at least one object
+    :param positions: real coordinates of the objects (objects x 2)
+    :param x_values: x values of the grid
+    :param y_values: y values of the grid
+    :return: boolean matrix with the shape of the grid
+    """
+    objects = np.zeros((len(x_values), len(y_values)), dtype=bool)
+    xs = np.rint((positions[:, 0] - x_values[0]) / (x_values[-1] - x_values[0]) * (len(x_values) - 1))
+    ys = np.rint((positions[:, 1] - y_values[0]) / (y_values[-1] - y_values[0]) * (len(y_values) - 1))
+    inside = (xs >= 0) & (xs < len(x_values)) & (ys >= 0) & (ys < len(y_values))
+    objects[xs[inside].astype(np.int64), ys[inside].astype(np.int64)] = True
+    return objects
+
+
+def distance_raster(objects, x_values, y_values, out=None, rows_per_block=256, rows_per_band=256):
+    """
+    Distance in metres from every cell of the grid to the nearest cell with an object
+    The nearest cell is found with the euclidean distance transform sampled with the metres of one step.
+    Haversine reads the x value as latitude, so the metres of a step along y change from row to row: the transform
+    is run once per band of rows, with the steps of the centre row of the band, and every band keeps its own rows.
+    The distance to the nearest cell is then measured with haversine, row by row, with the same
+    (x value, y value) convention used by the rest of the generation.
+    Inside a band the scale is the one of its centre row, so between two cells at almost the same distance the
+    transform can choose the farther one: the nearest cell is exact up to the change of scale over one band
+    :param objects: boolean matrix, True where there is an object
+    :param x_values: x values of the grid
+    :param y_values: y values of the grid
+    :param out: float32 matrix where to write the result, None to allocate it
+    :param rows_per_block: how many rows to measure every time
+    :param rows_per_band: how many rows share the same metres per step
+    :return: float32 matrix, inf everywhere if there are no objects
+    """
+    if out is None:
+        out = np.zeros(objects.shape, dtype=np.float32)
+    if not objects.any():
+        out[:] = np.inf
+        return out
+    y_centre = len(y_values) // 2
+    nearest = np.zeros((2,) + objects.shape, dtype=np.int32)
+    for band_start in range(0, objects.shape[0], rows_per_band):
+        rows = slice(band_start, band_start + rows_per_band)
+        x_centre = min(band_start + rows_per_band // 2, len(x_values) - 2)
+        centre = (x_values[x_centre], y_values[y_centre])
+        sampling = (haversine_array(centre, (x_values[x_centre + 1], centre[1])) * 1000,
+                    haversine_array(centre, (centre[0], y_values[y_centre + 1])) * 1000)
+        band_nearest = ndimage.distance_transform_edt(~objects, sampling=sampling, return_distances=False,
+                                                      return_indices=True)
+        nearest[:, rows] = band_nearest[:, rows]
+        del band_nearest
+
+    for start in range(0, objects.shape[0], rows_per_block):
+        rows = slice(start, start + rows_per_block)
+        cells = np.stack(np.broadcast_arrays(x_values[rows, None], y_values[None, :]), axis=-1)
+        targets = np.stack((x_values[nearest[0, rows]], y_values[nearest[1, rows]]), axis=-1)
+        out[rows] = haversine_array(cells, targets) * 1000  # in metres
+    return out
+
+
+class DistanceRasters(object):
+    """
+    One float32 raster per feature with the same size of the APF, every cell stores the distance in metres
+    to the nearest object of that feature. One read returns the distances of a point to all the features
+    """
+
+    def __init__(self, log=None, folder="distance_rasters"):
+        self._log = log
+        self._folder = "{}/{}".format(args.data_path, folder)
+        self.rasters = None
+
+    def build(self, positions, x_values, y_values, names, store=True):
+        """
+        Rasterise the objects of every feature and compute their distance rasters
+        :param positions: list of arrays (objects x 2), one per feature
+        :param x_values: x values of the grid
+        :param y_values: y values of the grid
+        :param names: name of every feature, used for the file names
+        :param store: True if the rasters are written in memory mapped files
+        :return:
+        """
+        x_values = np.asarray(x_values, dtype=np.float64)
+        y_values = np.asarray(y_values, dtype=np.float64)
+        if store:
+            os.makedirs(self._folder, exist_ok=True)
+        self.rasters = []
+        for name, objects in zip(names, positions):
+            if self._log is not None:
+                self._log.debug("Distance raster of {} ({} objects)".format(name, len(objects)))
+            out = None
+            if store:
+                out = np.lib.format.open_memmap("{}/{}.npy".format(self._folder, name), mode='w+',
+                                                dtype=np.float32, shape=(len(x_values), len(y_values)))
+            raster = distance_raster(objects=rasterise_positions(positions=objects, x_values=x_values,
+                                                                 y_values=y_values),
+                                     x_values=x_values, y_values=y_values, out=out)
+            if store:
+                raster.flush()
+            self.rasters.append(raster)
+
+    def load_stored(self, names):
+        """
+        If all the files are present, memory map them
+        :param names: name of every feature
+        :return: True if the rasters are loaded, False otherwise
+        """
+        name_files = ["{}/{}.npy".format(self._folder, name) for name in names]
+        if not all(os.path.isfile(name_file) for name_file in name_files):
+            return False
+        self.rasters = [np.load(name_file, mmap_mode='r') for name_file in name_files]
+        return True
+
+    def distances_for_points(self, xs, ys):
+        """
+        Distance to the nearest object of every feature
+        :param xs: array of x matrix coordinates
+        :param ys: array of y matrix coordinates
+        :return: matrix (points x features) of distances in metres
+        """
+        return np.stack([raster[xs, ys] for raster in self.rasters], axis=1)
+
+
+def build_distance_rasters(path_apf, log=None):
+    """
+    Preprocessing step: build and store the distance rasters of all the features of the dataset in args.data_path
+    The grid comes from the metadata of the APF, the objects from GenomeMeaning (csv files or memory mapped file)
+    :param path_apf: path of the APF
+    :param log: logger
+    :return: DistanceRasters built
+    """
+    loader_apf = LoadAPF(path=path_apf, logger=log)
+    loader_apf.load_apf_metadata()
+    loader_apf.match_index_with_coordinates()
+    genome_meaning = GenomeMeaning(logger=log)
+    # the tags of every feature (name_and_details) are needed, they are released with performance
+    genome_meaning.load_data(test=False, performance=False)
+
+    rasters = DistanceRasters(log=log)
+    rasters.build(positions=positions_per_feature(genome_meaning=genome_meaning), x_values=loader_apf.x_values,
+                  y_values=loader_apf.y_values, names=genome_meaning.name_typologies)
+    return rasters
+
+
+if __name__ == '__main__':
+    logger = logging.getLogger("DistanceRasters")
+    logger.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    ch.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(ch)
+    logger.info("Building the distance rasters")
+    build_distance_rasters(path_apf=args.data_path + args.apf_name, log=logger)
+    logger.info("Distance rasters stored")
@@ -0,0 +1,113 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import math
+
+from src.Helpers.Fitness.ValueGraphFitness import get_fitness_value
+
+# euclidean distance between two different one-hot directions
+DIFFERENT_DIRECTION_DISTANCE = math.sqrt(2)
+
+
+class TrajectoryFeatures(object):
+    """
+    Incremental version of compute_fintess_trajectory
+    It keeps the features of the trajectory moved so far and updates them point after point,
+    so the fitness of a trajectory extended with one more point is computed in O(1) and without copying it
+    """
+
+    def __init__(self, start):
+        self._xs = [start.x]
+        self._ys = [start.y]
+        self._last_direction = None
+        # sum of the distances between consecutive directions
+        self._curliness_sum = 0.0
+        self._number_curliness_distances = 0
+        # max cityblock distance to the start of all the points but the first and the last
+        self._further_distance = 0
+        self._last_distance = 0
+
+    def __len__(self):
+        return len(self._xs)
+
+    def _distance_from_start(self, x, y):
+        return abs(x - self._xs[0]) + abs(y - self._ys[0])
+
+    def _direction_to(self, point):
+        return point.x - self._xs[-1], point.y - self._ys[-1]
+
+    def _curliness_with_direction(self, direction):
+        """
+        Curliness of the trajectory if the next move has the given direction
+        :param direction: direction of the next move
+        :return: float curliness
+        """
+        if self._last_direction is None:
+            return 0.0
+        curliness_sum = self._curliness_sum
+        if direction != self._last_direction:
+            curliness_sum += DIFFERENT_DIRECTION_DISTANCE
+        return curliness_sum / (self._number_curliness_distances + 1)
+
+    def append(self, point):
+        """
+        Move the trajectory to the next point
+        :param point: next point
+        :return:
+        """
+        direction = self._direction_to(point=point)
+        if self._last_direction is not None:
+            if direction != self._last_direction:
+                self._curliness_sum += DIFFERENT_DIRECTION_DISTANCE
+            self._number_curliness_distances += 1
+        self._last_direction = direction
+        # the previous last point is now an internal point
+        if len(self._xs) > 1:
+            self._further_distance = max(self._further_distance, self._last_distance)
+        self._last_distance = self._distance_from_start(x=point.x, y=point.y)
+        self._xs.append(point.x)
+        self._ys.append(point.y)
+
+    def features_if_moving_to(self, point):
+        """
+        Features of the trajectory moved so far plus the given point
+        :param point: candidate next point
+        :return: length, curliness, further distance, distance to middle point and distance to end point
+        """
+        total_length = len(self._xs) + 1
+        curliness = self._curliness_with_direction(direction=self._direction_to(point=point))
+        further_distance_to_point = self._further_distance
+        if len(self._xs) > 1:
+            further_distance_to_point = max(further_distance_to_point, self._last_distance)
+
+        distance_to_end_point = self._distance_from_start(x=point.x, y=point.y)
+        middle_index = int(total_length / 2)
+        if middle_index < len(self._xs):
+            distance_to_middle_point = self._distance_from_start(x=self._xs[middle_index], y=self._ys[middle_index])
+        else:
+            distance_to_middle_point = distance_to_end_point
+        return [total_length, curliness, further_distance_to_point, distance_to_middle_point, distance_to_end_point]
+
+    def fitness_if_moving_to(self, point):
+        """
+        Same output of compute_fintess_trajectory on the trajectory moved so far plus the given point
+        :param point: candidate next point
+        :return: total fitness value and single fitness component
+        """
+        features = self.features_if_moving_to(point=point)
+        out, _, _, _ = get_fitness_value(length=features[0], curliness=features[1], further_distance=features[2])
+        return out, features
@@ -16,11 +16,14 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import logging
+import math
 import os
 import pickle
 
-from scipy.spatial import distance
+import numpy as np
+import shapely
 from shapely.geometry import Point
+from shapely.prepared import prep
 
 from src.Settings.args import args
 
@@ -77,17 +80,19 @@ def _get_fitness_length_curliness(point, external, internal):
     return actual_distance
 
 
-def _get_distance_to_center(point, internal, new_min=-300):
+def _get_distance_to_center(point, internal, new_min=-300, centroid=None):
     """
         Return distance from current feature selected to the center of the hull selected.
         It also normalised the value of the distance to new scale defined by global variable MAX_FITNESS
         :param point: value for the features chosen
         :param internal: information about the internal hull of the fitness landscape
         :param new_min: minimum value of the new scale
+        :param centroid: centroid of the internal hull if already computed
         :return: normalised and raw distance
         """
-    centroid = internal.centroid
-    d = -distance.euclidean([centroid.x, centroid.y], [point.x, point.y])
+    if centroid is None:
+        centroid = internal.centroid
+    d = -math.sqrt((centroid.x - point.x) ** 2 + (centroid.y - point.y) ** 2)
     max_value = -5000
     if d < max_value:
         d = max_value
@@ -95,69 +100,232 @@ def _get_distance_to_center(point, internal, new_min=-300):
     return fitness_value, d
 
 
-def _get_combination_two_fitness_curliness_length(point, internal_normal, internal_special, external):
+def _get_combination_two_fitness(value, point, internal_special, centroid=None):
     """
-        Return fitness value for the curliness and length features
+        Return fitness value for a pair of features from the distance to the hulls of the landscape
         Two cases, either the internal hull is considered as a plateau or the distance to the centroid is returned
+        :param value: distance from the important area (see _get_fitness_length_curliness)
         :param point: current value for the two features chosen
-        :param internal_normal: information of the internal hull
         :param internal_special: information of the internal hull with centroid
-        :param external: information about the external hull
+        :param centroid: centroid of the internal hull if already computed
         :return: fitness value
         """
-    value_from_curliness_length = _get_fitness_length_curliness(point=point,
-                                                                external=external,
-                                                                internal=internal_normal)
-    if value_from_curliness_length == 0:
-        value_from_curliness_length, _ = _get_distance_to_center(point=point,
-                                                                 internal=internal_special, new_min=100)
+    if value == 0:
+        value, _ = _get_distance_to_center(point=point, internal=internal_special, new_min=100, centroid=centroid)
     else:
-        value_from_curliness_length = convert(old_max=0, old_min=-150, new_max=100, new_min=-300,
-                                              old_value=value_from_curliness_length)
-    return value_from_curliness_length
+        value = convert(old_max=0, old_min=-150, new_max=100, new_min=-300, old_value=value)
+    return value
 
 
-def _get_combination_two_fitness_curliness_distance(point, internal_normal, internal_special, external):
+def _signed_distance_raster(polygon, xs, ys):
     """
-        Return fitness value for the curliness and distance features
-        Two cases, either the internal hull is considered as a plateau or the distance to the centroid is returned
-        :param point: current value for the two features chosen
-        :param internal_normal: information of the internal hull
-        :param internal_special: information of the internal hull with centroid
-        :param external: information about the external hull
-        :return: fitness value
+        Signed distance from the border of the polygon, negative inside, for every point of the grid
+        :param polygon: hull of the fitness landscape
+        :param xs: values of the first feature
+        :param ys: values of the second feature
+        :return: matrix (len(xs) x len(ys))
         """
-    value_from_curliness_distance = _get_fitness_length_curliness(point=point,
-                                                                  external=external,
-                                                                  internal=internal_normal)
-    if value_from_curliness_distance == 0:
-        value_from_curliness_distance, _ = _get_distance_to_center(point=point,
-                                                                   internal=internal_special, new_min=100)
-    else:
-        value_from_curliness_distance = convert(old_max=0, old_min=-150, new_max=100, new_min=-300,
-                                                old_value=value_from_curliness_distance)
-    return value_from_curliness_distance
+    border = polygon.boundary
+    if hasattr(shapely, "contains_xy"):
+        # shapely 2, all the points of the grid together
+        grid_xs, grid_ys = np.meshgrid(np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64),
+                                       indexing="ij")
+        distance_border = shapely.distance(border, shapely.points(grid_xs, grid_ys))
+        return np.where(shapely.contains_xy(polygon, grid_xs, grid_ys), -distance_border, distance_border)
+    prepared_polygon = prep(polygon)
+    raster = np.zeros((len(xs), len(ys)), dtype=np.float64)
+    for i, x in enumerate(xs):
+        for j, y in enumerate(ys):
+            point = Point(x, y)
+            distance_border = border.distance(point)
+            raster[i, j] = -distance_border if prepared_polygon.contains(point) else distance_border
+    return raster
 
 
-def _get_combination_two_fitness_length_distance(point, internal_normal, internal_special, external):
+class FitnessLandscape(object):
     """
-        Return fitness value for the distance and length features
-        Two cases, either the internal hull is considered as a plateau or the distance to the centroid is returned
-        :param point: current value for the two features chosen
-        :param internal_normal: information of the internal hull
-        :param internal_special: information of the internal hull with centroid
-        :param external: information about the external hull
+    Fitness landscape loaded once per process
+
+    For every pair of features the signed distances from the external and the internal hull are precomputed on
+    a regular grid covering the values the features can have, so the distance of a point from the important area
+    is a bilinear interpolation instead of a shapely contains/distance.
+    Points outside the grid, or every point if exact is True, are evaluated with the hulls
+    """
+    # (index external hull, index internal hull, index internal hull with centroid) per pair of features
+    PAIRS = [(0, 1, 6), (2, 3, 8), (4, 5, 10)]
+
+    def __init__(self, point_distance=None, exact=False, resolution=512, max_length=LIMIT_TIMESTEPS):
+        self._point_distance = point_distance if point_distance is not None else []
+        self._exact = exact
+        self._resolution = resolution
+        self.max_length = max_length
+        self._hulls = None
+        self._centroids = None
+        # curliness * 100, length, further distance
+        self._ranges = [(0.0, 100 * math.sqrt(2)), (0.0, float(max_length + 1)), (0.0, float(2 * (max_length + 1)))]
+        # features on the axis of every pair
+        self._axis = [(0, 1), (0, 2), (2, 1)]
+        # diagonal of one cell of the rasters of every pair: the interpolated distance is at most this far from the
+        # real one, closer to a border the side of the hull is not certain
+        self._tolerances = [math.hypot(*[(self._ranges[axis][1] - self._ranges[axis][0]) / (resolution - 1)
+                                         for axis in self._axis[k]]) for k in range(len(self.PAIRS))]
+        self._rasters = None
+
+    def load(self, shared_arrays=None):
+        """
+        Load the hulls and, if not exact, the rasters (computed and stored on disk if not present or outdated)
+        :param shared_arrays: dict name -> array attached from shared memory, the rasters are read from it if present
+        :return:
+        """
+        name_file = "{}/3d_fitness_in_2d_with_limitation.pickle".format(args.data_path)
+        with open(name_file, 'rb') as handle:
+            self._hulls = pickle.load(handle)
+        self._centroids = [self._hulls[internal_special].centroid for _, _, internal_special in self.PAIRS]
+        if self._exact:
+            return
+        if shared_arrays is not None and "fitness/external_0" in shared_arrays:
+            self._rasters = [(shared_arrays["fitness/external_{}".format(k)],
+                              shared_arrays["fitness/internal_{}".format(k)]) for k in range(len(self.PAIRS))]
+            return
+
+        name_raster = "{}/3d_fitness_in_2d_with_limitation_{}.npz".format(args.data_path, self._resolution)
+        ranges = np.array(self._ranges)
+        if os.path.isfile(name_raster) and os.path.getmtime(name_raster) >= os.path.getmtime(name_file):
+            with np.load(name_raster) as data:
+                if np.allclose(data["ranges"], ranges):
+                    self._rasters = [(data["external_{}".format(k)], data["internal_{}".format(k)])
+                                     for k in range(len(self.PAIRS))]
+                    return
+
+        logging.getLogger(args.name_exp).debug("Computing fitness landscape rasters")
+        self._rasters = []
+        to_store = {"ranges": ranges}
+        for k, (external, internal, _) in enumerate(self.PAIRS):
+            xs = np.linspace(*self._ranges[self._axis[k][0]], num=self._resolution)
+            ys = np.linspace(*self._ranges[self._axis[k][1]], num=self._resolution)
+            rasters = (_signed_distance_raster(polygon=self._hulls[external], xs=xs, ys=ys),
+                       _signed_distance_raster(polygon=self._hulls[internal], xs=xs, ys=ys))
+            self._rasters.append(rasters)
+            to_store["external_{}".format(k)] = rasters[0]
+            to_store["internal_{}".format(k)] = rasters[1]
+        # written under a temporary name, a process reading the rasters never finds a half written file
+        with open(name_raster + ".tmp", "wb") as handle:
+            np.savez(handle, **to_store)
+        os.replace(name_raster + ".tmp", name_raster)
+
+    def set_point_distance(self, point_distance):
+        """
+        Change the pairs of features using the distance to the central point
+        :param point_distance: list of indexes of the pairs, None for none of them
+        :return:
+        """
+        self._point_distance = point_distance if point_distance is not None else []
+
+    def publish(self, registry):
+        """
+        Publish the rasters in shared memory
+        :param registry: SharedArrayRegistry
+        :return:
+        """
+        if self._rasters is None:
+            return
+        for k, (external, internal) in enumerate(self._rasters):
+            registry.publish(name="fitness/external_{}".format(k), array=external)
+            registry.publish(name="fitness/internal_{}".format(k), array=internal)
+
+    def _interpolate(self, raster, x, y, axis):
+        """
+        Bilinear interpolation of the raster
+        :return: value interpolated, None if the point is outside the grid
+        """
+        min_x, max_x = self._ranges[axis[0]]
+        min_y, max_y = self._ranges[axis[1]]
+        if not (min_x <= x <= max_x and min_y <= y <= max_y):
+            return None
+        position_x = (x - min_x) / (max_x - min_x) * (self._resolution - 1)
+        position_y = (y - min_y) / (max_y - min_y) * (self._resolution - 1)
+        i = min(int(position_x), self._resolution - 2)
+        j = min(int(position_y), self._resolution - 2)
+        dx = position_x - i
+        dy = position_y - j
+        return (raster[i, j] * (1 - dx) * (1 - dy) + raster[i + 1, j] * dx * (1 - dy) +
+                raster[i, j + 1] * (1 - dx) * dy + raster[i + 1, j + 1] * dx * dy)
+
+    def _distance_from_area(self, k, x, y):
+        """
+        Same value of _get_fitness_length_curliness, from the rasters when the point is not close to a border
+        :param k: index of the pair of features
+        :param x: value of the first feature
+        :param y: value of the second feature
+        :return: distance from the important area
+        """
+        external, internal, _ = self.PAIRS[k]
+        if not self._exact:
+            # same inside test of shapely contains (the border is outside), points near a border use the hulls
+            tolerance = self._tolerances[k]
+            distance_internal = self._interpolate(raster=self._rasters[k][1], x=x, y=y, axis=self._axis[k])
+            if distance_internal is not None and abs(distance_internal) > tolerance:
+                if distance_internal < 0:
+                    return 0
+                distance_external = self._interpolate(raster=self._rasters[k][0], x=x, y=y, axis=self._axis[k])
+                if abs(distance_external) > tolerance:
+                    if distance_external < 0:
+                        return distance_internal
+                    return -distance_external
+        return _get_fitness_length_curliness(point=Point(x, y), external=self._hulls[external],
+                                             internal=self._hulls[internal])
+
+    def _get_value_pair(self, k, x, y):
+        """
+        Fitness of one pair of features
+        :param k: index of the pair of features
+        :param x: value of the first feature
+        :param y: value of the second feature
         :return: fitness value
         """
-    value_from_distance_length = _get_fitness_length_curliness(point=point, external=external,
-                                                               internal=internal_normal)
-    if value_from_distance_length == 0:
-        value_from_distance_length, _ = _get_distance_to_center(point=point, internal=internal_special,
-                                                                new_min=100)
-    else:
-        value_from_distance_length = convert(old_max=0, old_min=-150, new_max=100, new_min=-300,
-                                             old_value=value_from_distance_length)
-    return value_from_distance_length
+        value = self._distance_from_area(k=k, x=x, y=y)
+        if k in self._point_distance:
+            return _get_combination_two_fitness(value=value, point=Point(x, y),
+                                                internal_special=self._hulls[self.PAIRS[k][2]],
+                                                centroid=self._centroids[k])
+        return convert(old_max=0, old_min=-150, new_max=MAX_FITNESS, new_min=-300, old_value=value)
+
+    def get_fitness_value(self, length, curliness, further_distance):
+        """
+        Get combined fitness function
+        :param length: current length of the trajectory
+        :param curliness: curliness of the trajectory
+        :param further_distance: further distance to start of the trajectory
+        :return: total fitness and fitness of the three pairs of features
+        """
+        value_from_curliness_length = self._get_value_pair(k=0, x=curliness * 100, y=length)
+        value_from_curliness_distance = self._get_value_pair(k=1, x=curliness * 100, y=further_distance)
+        value_from_distance_length = self._get_value_pair(k=2, x=further_distance, y=length)
+        return value_from_distance_length + value_from_curliness_length + value_from_curliness_distance, \
+            value_from_distance_length, value_from_curliness_length, value_from_curliness_distance
+
+
+_fitness_landscape = None
+
+
+def load_fitness_landscape(shared_arrays=None, max_distance=None):
+    """
+    Return the fitness landscape of the process, loading it the first time
+    The rasters cover trajectories up to the longest distance to travel, they are loaded again if a longer one is
+    requested
+    :param shared_arrays: dict name -> array attached from shared memory, used by the first load
+    :param max_distance: longest distance to travel of the trajectories, None for the one of the command line
+    :return: FitnessLandscape
+    """
+    global _fitness_landscape
+    if max_distance is None:
+        max_distance = args.total_distance_to_travel
+    max_length = max(LIMIT_TIMESTEPS, max_distance)
+    if _fitness_landscape is None or _fitness_landscape.max_length < max_length:
+        _fitness_landscape = FitnessLandscape(point_distance=args.point_distance, exact=args.fitness_exact,
+                                              resolution=args.fitness_resolution, max_length=max_length)
+        _fitness_landscape.load(shared_arrays=shared_arrays)
+    return _fitness_landscape
 
 
 def get_fitness_value(length, curliness, further_distance):
@@ -165,58 +333,11 @@ def get_fitness_value(length, curliness, further_distance):
         Get combined fitness function
         :param length: current length of the trajectory
         :param curliness: curliness of the trajectory
-        :param fitness_landscape: data defining the fitness landscape
         :param further_distance: further distance to start of the trajectory
-        :param point_distance: modification to the fitness function
         :return:
         """
-    fitness_landscape = pickle.load(open("{}/3d_fitness_in_2d_with_limitation.pickle".format(args.data_path), 'rb'))
-    point_distance = args.point_distance
-    if point_distance is None:
-        point_distance = []
-
-    point = Point(curliness * 100, length)
-
-    if 0 in point_distance:
-        value_from_curliness_length = \
-            _get_combination_two_fitness_curliness_length(point=point, internal_normal=fitness_landscape[1],
-                                                          external=fitness_landscape[0],
-                                                          internal_special=fitness_landscape[6])
-        # value_from_curliness_length, _ = _get_distance_to_center(point=point, internal=fitness_landscape[6])
-    else:
-        value_from_curliness_length = _get_fitness_length_curliness(point=point, external=fitness_landscape[0],
-                                                                    internal=fitness_landscape[1])
-        value_from_curliness_length = convert(old_max=0, old_min=-150, new_max=MAX_FITNESS, new_min=-300,
-                                              old_value=value_from_curliness_length)
-
-    point = Point(curliness * 100, further_distance)
-    if 1 in point_distance:
-        value_from_curliness_distance = \
-            _get_combination_two_fitness_curliness_distance(point=point, internal_normal=fitness_landscape[3],
-                                                            external=fitness_landscape[2],
-                                                            internal_special=fitness_landscape[8])
-        # value_from_curliness_distance, _ = _get_distance_to_center(point=point, internal=fitness_landscape[8])
-    else:
-        value_from_curliness_distance = _get_fitness_length_curliness(point=point, external=fitness_landscape[2],
-                                                                      internal=fitness_landscape[3])
-        value_from_curliness_distance = convert(old_max=0, old_min=-150, new_max=MAX_FITNESS, new_min=-300,
-                                              old_value=value_from_curliness_distance)
-
-    point = Point(further_distance, length)
-    if 2 in point_distance:
-        value_from_distance_length = \
-            _get_combination_two_fitness_length_distance(point=point, internal_normal=fitness_landscape[5],
-                                                         external=fitness_landscape[4],
-                                                         internal_special=fitness_landscape[10])
-        # value_from_distance_length, _ = _get_distance_to_center(point=point, internal=fitness_landscape[10])
-    else:
-        value_from_distance_length = _get_fitness_length_curliness(point=point, external=fitness_landscape[4],
-                                                                   internal=fitness_landscape[5])
-        value_from_distance_length = convert(old_max=0, old_min=-150, new_max=MAX_FITNESS, new_min=-300,
-                                              old_value=value_from_distance_length)
-
-    return value_from_distance_length + value_from_curliness_length + value_from_curliness_distance, \
-           value_from_distance_length, value_from_curliness_length, value_from_curliness_distance
+    return load_fitness_landscape().get_fitness_value(length=length, curliness=curliness,
+                                                      further_distance=further_distance)
 
 
 def convert(old_max, old_min, new_max, new_min, old_value):
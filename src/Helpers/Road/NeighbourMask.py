@@ -0,0 +1,166 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import json
+import os
+
+import numpy as np
+
+from src.Settings.args import args
+from src.Utils.SharedArrays import is_memory_mapped
+from src.Utils.Funcs import NEIGHBOURS_X_OFFSET, NEIGHBOURS_Y_OFFSET
+
+# for every possible mask, the directions with the bit set
+DIRECTIONS_PER_MASK = [np.array([k for k in range(8) if mask & (1 << k)], dtype=np.int32) for mask in range(256)]
+# for every possible mask, one row per direction (1 if the bit is set)
+BITS_PER_MASK = np.array([[(mask >> k) & 1 for k in range(8)] for mask in range(256)], dtype=bool)
+
+
+def road_from_indexing(indexing, rows_per_block=512):
+    """
+    Compute the road raster from the indexing matrix (first value different from 0 means road)
+    The indexing matrix is read in blocks of rows in order not to load all of it in memory
+    :param indexing: memmap with the indexing of the cells
+    :param rows_per_block: how many rows to read every time
+    :return: boolean matrix, True if the cell is a road
+    """
+    road = np.zeros(indexing.shape[:2], dtype=bool)
+    for start in range(0, indexing.shape[0], rows_per_block):
+        road[start:start + rows_per_block] = indexing[start:start + rows_per_block, :, 0] != 0
+    return road
+
+
+def build_neighbour_mask(road):
+    """
+    Compute the neighbour raster from the road raster
+    Bit k of a cell is set if the neighbour in direction k (same order of list_neighbours) is inside the matrix
+    and it is a road
+    :param road: boolean matrix, True if the cell is a road
+    :return: uint8 matrix with the same shape of road
+    """
+    x_max, y_max = road.shape
+    mask = np.zeros((x_max, y_max), dtype=np.uint8)
+    for k in range(8):
+        dx = int(NEIGHBOURS_X_OFFSET[k])
+        dy = int(NEIGHBOURS_Y_OFFSET[k])
+        # cells whose neighbour in direction k is still inside the matrix
+        target = mask[max(0, -dx):x_max - max(0, dx), max(0, -dy):y_max - max(0, dy)]
+        neighbour = road[max(0, dx):x_max + min(0, dx), max(0, dy):y_max + min(0, dy)]
+        target |= neighbour.astype(np.uint8) << k
+    return mask
+
+
+class NeighbourMask(object):
+    """
+    Raster with the same size of the APF where every cell stores which neighbours are road
+    One read returns all the valid moves from a cell
+    """
+
+    def __init__(self, log=None):
+        self._log = log
+        self.mask = None
+
+    def build_from_indexing(self, indexing):
+        """
+        Build the raster from the indexing matrix
+        :param indexing: memmap with the indexing of the cells
+        :return:
+        """
+        if self._log is not None:
+            self._log.debug("Building neighbour mask")
+        self.mask = build_neighbour_mask(road=road_from_indexing(indexing=indexing))
+
+    def store(self, name="neighbour_mask", source=None):
+        """
+        Store the raster on disk in order not to build it every experiment
+        The raster and then the signature of the indexing it comes from are written through temporary files
+        :param name: name of the file
+        :param source: signature of the indexing matrix (see DataBundle.signature)
+        :return:
+        """
+        name_file = "{}/{}.npy".format(args.data_path, name)
+        source_file = "{}/{}.source.json".format(args.data_path, name)
+        # the old signature goes first, a raster without it is built again
+        if os.path.isfile(source_file):
+            os.remove(source_file)
+        with open(name_file + ".tmp", 'wb') as f:
+            np.save(f, self.mask)
+        os.replace(name_file + ".tmp", name_file)
+        with open(source_file + ".tmp", 'w') as f:
+            json.dump(source, f)
+        os.replace(source_file + ".tmp", source_file)
+
+    def load_stored(self, name="neighbour_mask", source=None):
+        """
+        If the file is present and it comes from the same indexing matrix, memory map it
+        :param name: name of the file
+        :param source: signature of the indexing matrix (see DataBundle.signature)
+        :return: True if the raster is loaded, False otherwise
+        """
+        name_file = "{}/{}.npy".format(args.data_path, name)
+        source_file = "{}/{}.source.json".format(args.data_path, name)
+        if not os.path.isfile(name_file) or not os.path.isfile(source_file):
+            return False
+        with open(source_file, 'r') as f:
+            if json.load(f) != source:
+                return False
+        mask = np.load(name_file, mmap_mode='r')
+        if source is not None and list(mask.shape) != source["shape"][:2]:
+            return False
+        self.mask = mask
+        return True
+
+    def publish(self, registry, name="neighbour_mask"):
+        """
+        Publish the raster in shared memory, if it is not memory mapped from disk
+        :param registry: SharedArrayRegistry
+        :param name: name of the array
+        :return:
+        """
+        if not is_memory_mapped(self.mask):
+            registry.publish(name=name, array=self.mask)
+
+    def load_shared(self, arrays, name="neighbour_mask"):
+        """
+        If the raster is among the shared arrays, use it
+        :param arrays: dict name -> array attached from shared memory, None if there are not
+        :param name: name of the array
+        :return: True if the raster is loaded, False otherwise
+        """
+        if arrays is None or name not in arrays:
+            return False
+        self.mask = arrays[name]
+        return True
+
+    def neighbours(self, x, y):
+        """
+        Return the neighbours of the cell that are road
+        :param x: x matrix coordinate
+        :param y: y matrix coordinate
+        :return: x and y coordinates of the neighbours
+        """
+        directions = DIRECTIONS_PER_MASK[self.mask[x, y]]
+        return x + NEIGHBOURS_X_OFFSET[directions], y + NEIGHBOURS_Y_OFFSET[directions]
+
+    def valid_directions(self, xs, ys):
+        """
+        Vectorised version of neighbours
+        :param xs: array of x matrix coordinates
+        :param ys: array of y matrix coordinates
+        :return: boolean matrix (points x 8), True if the neighbour in that direction is road
+        """
+        return BITS_PER_MASK[self.mask[xs, ys]]
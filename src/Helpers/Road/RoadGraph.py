@@ -0,0 +1,222 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import json
+import os
+
+import numpy as np
+
+from src.Helpers.Road.NeighbourMask import BITS_PER_MASK
+from src.Settings.args import args
+from src.Utils.Funcs import NEIGHBOURS_X_OFFSET, NEIGHBOURS_Y_OFFSET
+from src.Utils.Point import Point
+
+NO_NODE = -1
+# arrays defining the graph
+ARRAYS = ("node_linear", "indptr", "indices", "directions")
+
+
+class RoadGraph(object):
+    """
+    Graph of the road cells only
+    Every road cell has a dense int32 id (ordered as the cells in the matrix, row by row)
+    The 8-neighbourhood is stored in CSR format: the neighbours of node n are indices[indptr[n]:indptr[n + 1]]
+    and directions holds the direction (same order of list_neighbours) of every edge
+    """
+
+    def __init__(self, log=None):
+        self._log = log
+        self.shape = None
+        self.node_linear = None
+        self.indptr = None
+        self.indices = None
+        self.directions = None
+
+    @property
+    def number_of_nodes(self):
+        return len(self.node_linear)
+
+    def build(self, road, mask):
+        """
+        Build the graph from the road raster and the neighbour mask
+        :param road: boolean matrix, True if the cell is a road
+        :param mask: neighbour mask (see NeighbourMask)
+        :return:
+        """
+        if self._log is not None:
+            self._log.debug("Building road graph")
+        self.shape = road.shape
+        self.node_linear = np.flatnonzero(road).astype(np.int64)
+        xs, ys = np.divmod(self.node_linear, self.shape[1])
+
+        valid = BITS_PER_MASK[mask[xs, ys]]
+        degree = valid.sum(axis=1)
+        self.indptr = np.zeros(len(self.node_linear) + 1, dtype=np.int32)
+        np.cumsum(degree, out=self.indptr[1:])
+
+        # row major order -> edges sorted by node and then by direction
+        nodes, directions = np.nonzero(valid)
+        neighbours_linear = self.node_linear[nodes] + (NEIGHBOURS_X_OFFSET[directions].astype(np.int64) *
+                                                       self.shape[1] + NEIGHBOURS_Y_OFFSET[directions])
+        self.indices = np.searchsorted(self.node_linear, neighbours_linear).astype(np.int32)
+        self.directions = directions.astype(np.uint8)
+        if self._log is not None:
+            self._log.debug("Road graph with {} nodes and {} edges".format(len(self.node_linear), len(self.indices)))
+
+    def store(self, name="road_graph", source=None):
+        """
+        Store the graph on disk in order not to build it every experiment
+        The file is written through a temporary file, with the signature of the indexing the graph comes from
+        :param name: name of the file
+        :param source: signature of the indexing matrix (see DataBundle.signature)
+        :return:
+        """
+        name_file = "{}/{}.npz".format(args.data_path, name)
+        with open(name_file + ".tmp", 'wb') as f:
+            np.savez(f, shape=np.array(self.shape), node_linear=self.node_linear, indptr=self.indptr,
+                     indices=self.indices, directions=self.directions, source=np.array(json.dumps(source)))
+        os.replace(name_file + ".tmp", name_file)
+
+    def load_stored(self, name="road_graph", source=None):
+        """
+        If the file is present and it comes from the same indexing matrix, load the graph from it
+        :param name: name of the file
+        :param source: signature of the indexing matrix (see DataBundle.signature)
+        :return: True if the graph is loaded, False otherwise
+        """
+        name_file = "{}/{}.npz".format(args.data_path, name)
+        if not os.path.isfile(name_file):
+            return False
+        with np.load(name_file) as data:
+            if "source" not in data.files or json.loads(str(data["source"])) != source:
+                return False
+            shape = tuple(int(el) for el in data["shape"])
+            if source is not None and list(shape) != source["shape"][:2]:
+                return False
+            self.shape = shape
+            self.node_linear = data["node_linear"]
+            self.indptr = data["indptr"]
+            self.indices = data["indices"]
+            self.directions = data["directions"]
+        return True
+
+    def publish(self, registry, name="road_graph"):
+        """
+        Publish the graph in shared memory
+        :param registry: SharedArrayRegistry
+        :param name: prefix of the name of the arrays
+        :return:
+        """
+        registry.publish(name="{}/shape".format(name), array=np.array(self.shape))
+        for field in ARRAYS:
+            registry.publish(name="{}/{}".format(name, field), array=getattr(self, field))
+
+    def load_shared(self, arrays, name="road_graph"):
+        """
+        If the graph is among the shared arrays, use it
+        :param arrays: dict name -> array attached from shared memory, None if there are not
+        :param name: prefix of the name of the arrays
+        :return: True if the graph is loaded, False otherwise
+        """
+        if arrays is None or "{}/shape".format(name) not in arrays:
+            return False
+        self.shape = tuple(int(el) for el in arrays["{}/shape".format(name)])
+        for field in ARRAYS:
+            setattr(self, field, arrays["{}/{}".format(name, field)])
+        return True
+
+    def node_ids(self, xs, ys):
+        """
+        Return the id of the nodes in the given matrix coordinates
+        :param xs: array of x matrix coordinates
+        :param ys: array of y matrix coordinates
+        :return: int32 array of ids, NO_NODE where the cell is not a road
+        """
+        linear = np.asarray(xs, dtype=np.int64) * self.shape[1] + np.asarray(ys, dtype=np.int64)
+        positions = np.searchsorted(self.node_linear, linear)
+        positions = np.minimum(positions, len(self.node_linear) - 1)
+        return np.where(self.node_linear[positions] == linear, positions, NO_NODE).astype(np.int32)
+
+    def node_id(self, x, y):
+        """
+        Return the id of the node in the given matrix coordinate
+        :param x: x matrix coordinate
+        :param y: y matrix coordinate
+        :return: int id, NO_NODE if the cell is not a road
+        """
+        return int(self.node_ids(xs=[x], ys=[y])[0])
+
+    def nearest_node(self, x, y):
+        """
+        Return the id of the road node closest (in matrix cells) to the given matrix coordinate
+        The nodes are searched in a band of rows around x that doubles until the closest node found is inside it
+        :param x: x matrix coordinate
+        :param y: y matrix coordinate
+        :return: int id, the node of the cell itself if it is a road, NO_NODE if the graph is empty
+        """
+        if self.number_of_nodes == 0:
+            return NO_NODE
+        node = self.node_id(x=x, y=y)
+        if node != NO_NODE:
+            return node
+        radius = 1
+        while True:
+            first = int(np.searchsorted(self.node_linear, max(x - radius, 0) * self.shape[1]))
+            last = int(np.searchsorted(self.node_linear, (x + radius + 1) * self.shape[1]))
+            whole_graph = x - radius <= 0 and x + radius >= self.shape[0] - 1
+            if last > first:
+                xs, ys = np.divmod(self.node_linear[first:last], self.shape[1])
+                distances = (xs - x) ** 2 + (ys - y) ** 2
+                best = int(np.argmin(distances))
+                # a node outside the band is more than radius rows away
+                if distances[best] <= radius ** 2 or whole_graph:
+                    return first + best
+            radius *= 2
+
+    def coordinates(self, ids):
+        """
+        Return the matrix coordinates of the nodes
+        :param ids: array of node ids
+        :return: x and y coordinates
+        """
+        xs, ys = np.divmod(self.node_linear[ids], self.shape[1])
+        return xs.astype(np.int32), ys.astype(np.int32)
+
+    def points(self, ids):
+        """
+        Return the nodes as list of points
+        :param ids: list of node ids
+        :return: list of points
+        """
+        xs, ys = self.coordinates(ids=np.asarray(ids, dtype=np.int64))
+        return [Point(x, y) for x, y in zip(xs.tolist(), ys.tolist())]
+
+    def neighbours(self, node):
+        """
+        Return the neighbours of the node
+        :param node: node id
+        :return: int32 array with the ids of the neighbours
+        """
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def degrees(self, nodes):
+        """
+        Return how many neighbours every node has
+        :param nodes: array of node ids
+        :return: array of degrees
+        """
+        return self.indptr[nodes + 1] - self.indptr[nodes]
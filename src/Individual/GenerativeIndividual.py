@@ -18,11 +18,13 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import numpy as np
 
 import random
-from haversine import haversine
 
 from src.RandomWalk.PointGenerator import PointGenerator
+from src.RandomWalk.RandomWalkBatched import walker_random_states
 from src.Utils.Point import Point
-from src.Utils.RandomWrappers import random_wrapper_lognorm
+from src.Utils.RandomWrappers import random_wrapper_lognorm_vector
+from src.Utils.Resampling import resample_path, resample_paths, segment_lengths, step_length_table
+from src.Utils.Trajectory import Trajectory
 
 K = 0.1
 TIMESTEP = 1
@@ -30,14 +32,16 @@ TIMESTEP = 1
 
 class TrajectoryGeneration(object):
     def __init__(self, values_matrix, apf, pre_loaded_points,
-                 type_of_generator, pre_matrix, genotype=None, total_distance_to_travel=5000):
-        self.path = []
-        self.tra = []
-        self.tra_real_coordinates = []
+                 type_of_generator, pre_matrix, genotype=None, total_distance_to_travel=5000, step_lengths=None):
+        self.path_nodes = None
+        self.trajectory = None
 
         self.genome = genotype
         #
         self._values_matrix = values_matrix
+        if step_lengths is None:
+            step_lengths = step_length_table(x_values=values_matrix[0], y_values=values_matrix[1])
+        self._step_lengths = step_lengths
         self._apf = apf
         self._pre_loaded_points = pre_loaded_points
         self._pre_matrix = pre_matrix
@@ -45,6 +49,16 @@ class TrajectoryGeneration(object):
         self.generator = PointGenerator(typology_needed=type_of_generator, pre_matrix=self._pre_matrix)
         self._total_distance_to_travel = total_distance_to_travel
 
+    def configure(self, type_of_generator, total_distance_to_travel):
+        """
+        Change the method and the distance of the next trajectories, the data loaded is kept
+        :param type_of_generator: type of random walk
+        :param total_distance_to_travel: distance to travel
+        :return:
+        """
+        self.generator = PointGenerator(typology_needed=type_of_generator, pre_matrix=self._pre_matrix)
+        self._total_distance_to_travel = total_distance_to_travel
+
     def create_trajectory(self, random_seed, idx):
         """
         Function that creates a trajectory from the value of the genome
@@ -59,91 +73,114 @@ class TrajectoryGeneration(object):
         -> transform path into trajectory
         :param random_seed: seed for random
         :param idx: index starting point
-        :return:
+        :return: Trajectory
         """
         random.seed(random_seed)
         np.random.seed(random_seed)
 
-        self.path = []
-        self.tra = []
-        self.tra_real_coordinates = []
-        distances = []
-        while self.path is None or len(self.path) == 0:
-            if self.path is None:
-                self.path = []
-            # adding point to path
+        self.path_nodes = None
+        while self.path_nodes is None or len(self.path_nodes) == 0:
             pre_loaded_point = self._pre_loaded_points.get_point(idx_tra=idx)
             current_node = Point(x=pre_loaded_point[0], y=pre_loaded_point[1])
-            self.path.append(current_node)
             # get the path using the methodology chosen
-            self.path = self.generator.get_path(total_distance=self._total_distance_to_travel,
-                                                genome=self.genome, K=K,
-                                                current_node=current_node, apf=self._apf.shape)
-
-        if len(distances) == 0:
-            for i in range(len(self.path) - 1):
-                start = self.path[i]
-                end = self.path[i + 1]
-                dis = haversine((self._values_matrix[0][start.x], self._values_matrix[1][start.y]),
-                                (self._values_matrix[0][end.x],
-                                 self._values_matrix[1][end.y])) * 1000  # in metres
-                distances.append(dis)
+            self.path_nodes = np.array(self.generator.get_path(total_distance=self._total_distance_to_travel,
+                                                               genome=self.genome, K=K,
+                                                               current_node=current_node, apf=self._apf.shape),
+                                       dtype=np.int32)
+
+        return self._transform_path_into_trajectory()
+
+    def create_trajectories(self, random_seed, idxs):
+        """
+        Function that creates many trajectories at the same time
+        Only for the methods that can move all the walkers together (see PointGenerator.supports_batch)
+
+        -> load all the initial points
+        -> generate all the paths together
+        -> transform every path into trajectory
+        Every walker has its own random stream keyed on (random_seed, idx): the trajectory of an index does not
+        depend on the other indexes of the batch
+        :param random_seed: seed for random
+        :param idxs: indexes starting points
+        :return: list of Trajectory, one per index
+        """
+        random.seed(random_seed)
+        np.random.seed(random_seed)
+
+        random_states = walker_random_states(random_seed=random_seed, idxs=idxs)
+        starts = []
+        for idx in idxs:
+            pre_loaded_point = self._pre_loaded_points.get_point(idx_tra=idx)
+            starts.append(Point(x=pre_loaded_point[0], y=pre_loaded_point[1]))
+        paths, lengths = self.generator.get_paths(total_distance=self._total_distance_to_travel,
+                                                  starts=starts, apf=self._apf.shape, random_states=random_states)
+        # all the paths are resampled together, the padding moves are never read
+        xs, ys = self._pre_matrix.road_graph.coordinates(ids=paths)
+        distances = segment_lengths(xs=xs, ys=ys, step_lengths=self._step_lengths)
+        # the speeds continue the stream of the walker
+        speeds = TIMESTEP * np.array([state.lognormal(0, 1, size=distances.shape[1]) for state in random_states],
+                                     dtype=np.float64).reshape(distances.shape)
+        all_tra_indices = resample_paths(distances=distances, number_of_moves=lengths - 1, speeds=speeds)
+        results = []
+        for i in range(len(idxs)):
+            self.path_nodes = paths[i, :lengths[i]].copy()
+            results.append(self._build_trajectory(xs=xs[i, :lengths[i]], ys=ys[i, :lengths[i]],
+                                                  tra_indices=all_tra_indices[i]))
+        return results
+
+    def _transform_path_into_trajectory(self):
+        """
+        Transform the path generated into a trajectory
+        :return: Trajectory
+        """
+        xs, ys = self._pre_matrix.road_graph.coordinates(ids=self.path_nodes)
+        distances = segment_lengths(xs=xs, ys=ys, step_lengths=self._step_lengths)
 
         # now I have the path. Need to transform it in to a trajectory
-        self.tra.append(self.path[0])
-        i = 0
-        while i < len(self.path) - 1:
-            # speed is in metres per second
-            speed = random_wrapper_lognorm(mean=0, std=1)
-            # space is in metres
-            space = TIMESTEP * speed
-
-            current_distance = 0
-            if i >= len(distances) - 1:
-                break
-            while current_distance < space:
-                if i >= len(distances) - 1:
-                    break
-                current_distance += distances[i]
-                i += 1
-            self.tra.append(self.path[i])
-
-        self.tra_real_coordinates = [Point(self._values_matrix[0][p.x], self._values_matrix[1][p.y]) for p in self.tra]
+        # speed is in metres per second, space is in metres
+        speeds = TIMESTEP * random_wrapper_lognorm_vector(mean=0, std=1, elements=len(distances))
+        return self._build_trajectory(xs=xs, ys=ys, tra_indices=resample_path(distances=distances, speeds=speeds))
+
+    def _build_trajectory(self, xs, ys, tra_indices):
+        """
+        Collect the points of the trajectory and their distances to the tags
+        :param xs: x matrix coordinates of the path
+        :param ys: y matrix coordinates of the path
+        :param tra_indices: position in the path of the points of the trajectory
+        :return: Trajectory
+        """
+        tra_xs = xs[tra_indices]
+        tra_ys = ys[tra_indices]
+        real = np.stack((np.asarray(self._values_matrix[0])[tra_xs],
+                         np.asarray(self._values_matrix[1])[tra_ys]), axis=1)
 
         # return the distances to every points
         # now we will compute distances every time.
         # what can we use? To the nearest? To the five closest?
         # let's start distance to the nearest
-        total_distances = [self._pre_matrix.return_distance_from_point(current_position=point) for point in self.tra]
+        total_distances = self._pre_matrix.return_distances_for_points(xs=tra_xs, ys=tra_ys)
 
-        return total_distances, self.tra, self.tra_real_coordinates, self.path
+        self.trajectory = Trajectory(path_nodes=self.path_nodes, path=np.stack((xs, ys), axis=1),
+                                     tra_indices=tra_indices, real=real, distances=total_distances)
+        return self.trajectory
 
     def save_trajectory_generated(self):
         """
         Store the trajectory generated on a file
         :return: string containing all the points
         """
-        dic_tra_generated = {}
-        for i in range(len(self.tra_real_coordinates)):
-                dic_tra_generated[i] = self.tra_real_coordinates[i]
-        return dic_tra_generated
+        return dict(enumerate(self.trajectory.real_points()))
 
     def save_raw_trajectory_generated(self):
         """
         Store the raw trajectory generated on a file
         :return: string containing all the points
         """
-        dic_tra_generated = {}
-        for i in range(len(self.tra)):
-            dic_tra_generated[i] = self.tra[i]
-        return dic_tra_generated
+        return dict(enumerate(self.trajectory.tra_points()))
 
     def save_raw_path_generated(self):
         """
         Store the raw path generated on a file
         :return: string containing all the points
         """
-        dic_tra_generated = {}
-        for i in range(len(self.path)):
-            dic_tra_generated[i] = self.path[i]
-        return dic_tra_generated
\ No newline at end of file
+        return dict(enumerate(self.trajectory.path_points()))
@@ -0,0 +1,147 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import json
+import os
+
+import numpy as np
+
+from src.Settings.args import args
+
+MANIFEST_NAME = "manifest.json"
+BUNDLE_VERSION = 1
+
+# arrays of the original dataset, written before the manifest existed: file, dtype and shape
+LEGACY_ARRAYS = {
+    "cell_data": ("cell_data_to_mmap.dat", "float32", (154, 155, 6, 2, 1600)),
+    "indexing": ("indexing_fast.dat", "int16", (6159, 6083, 2)),
+    "matrix_id": ("matrix_id_matrix_mmap.dat", "int8", (6159, 6201, 2)),
+    "name_and_position": ("name_and_position.dat", "float32", (56, 938737, 2)),
+}
+
+
+def legacy_manifest(data_path):
+    """
+    Manifest describing the raw files of the original dataset that are present in the folder
+    :param data_path: folder of the dataset
+    :return: dict manifest
+    """
+    arrays = {}
+    for name, (name_file, dtype, shape) in LEGACY_ARRAYS.items():
+        if os.path.isfile(os.path.join(data_path, name_file)):
+            arrays[name] = {"file": name_file, "format": "raw", "dtype": dtype, "shape": list(shape), "offset": 0,
+                            "version": BUNDLE_VERSION}
+    return {"version": BUNDLE_VERSION, "crs": "EPSG:4326",
+            "bounds": {"north": args.north, "south": args.south, "east": args.east, "west": args.west},
+            "arrays": arrays}
+
+
+def write_legacy_manifest(data_path=None):
+    """
+    Write the manifest of the original dataset in its folder, so it becomes a bundle
+    :param data_path: folder of the dataset, args.data_path if None
+    :return: dict manifest written
+    """
+    data_path = args.data_path if data_path is None else data_path
+    manifest = legacy_manifest(data_path=data_path)
+    with open(os.path.join(data_path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class DataBundle(object):
+    """
+    Folder with the arrays of one dataset plus a manifest.json describing them
+    Every array has file, format (raw or npy), dtype, shape, offset and version; the bundle has the CRS and the bounds
+    Arrays are opened lazily as read-only memory maps, the first time they are requested
+    Folders without the manifest are read with the shapes of the original dataset
+    """
+
+    def __init__(self, data_path=None):
+        self._data_path = args.data_path if data_path is None else data_path
+        name_manifest = os.path.join(self._data_path, MANIFEST_NAME)
+        if os.path.isfile(name_manifest):
+            with open(name_manifest, 'r') as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = legacy_manifest(data_path=self._data_path)
+        if self.manifest["version"] > BUNDLE_VERSION:
+            raise ValueError("Bundle version {} not supported (max {})".format(self.manifest["version"],
+                                                                                BUNDLE_VERSION))
+        self._arrays = {}
+
+    @property
+    def bounds(self):
+        return self.manifest["bounds"]
+
+    def has(self, name):
+        """
+        Check if the bundle contains the array
+        :param name: name of the array
+        :return: True if it is present
+        """
+        return name in self.manifest["arrays"]
+
+    def shape(self, name):
+        """
+        Return the shape of the array without opening it
+        :param name: name of the array
+        :return: tuple shape
+        """
+        return tuple(self.manifest["arrays"][name]["shape"])
+
+    def signature(self, name):
+        """
+        Describe the file of the array, the caches derived from it are rebuilt when it changes
+        :param name: name of the array
+        :return: dict with shape, size and modification time of the file
+        """
+        stat = os.stat(os.path.join(self._data_path, self.manifest["arrays"][name]["file"]))
+        return {"shape": list(self.shape(name=name)), "size": stat.st_size, "mtime": stat.st_mtime}
+
+    def open(self, name):
+        """
+        Memory map the array (read only)
+        :param name: name of the array
+        :return: numpy memmap
+        """
+        if name not in self._arrays:
+            if not self.has(name):
+                raise ValueError("Array {} not present in the bundle {}".format(name, self._data_path))
+            description = self.manifest["arrays"][name]
+            name_file = os.path.join(self._data_path, description["file"])
+            if description.get("format", "raw") == "npy":
+                self._arrays[name] = np.load(name_file, mmap_mode='r')
+            else:
+                self._arrays[name] = np.memmap(name_file, dtype=description["dtype"], mode='r',
+                                               offset=description.get("offset", 0),
+                                               shape=tuple(description["shape"]))
+        return self._arrays[name]
+
+
+_data_bundle = None
+
+
+def load_data_bundle():
+    """
+    Return the bundle of args.data_path, opened once per process
+    :return: DataBundle
+    """
+    global _data_bundle
+    if _data_bundle is None:
+        _data_bundle = DataBundle()
+    return _data_bundle
@@ -17,22 +17,27 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import os
 
-import csv
 import json
 import pickle
 from pathlib import Path
 
-import numpy as np
-
+from src.Loaders.DataBundle import load_data_bundle
+from src.Loaders.PositionsCache import load_positions
 from src.Settings.args import args
 
 
+# profiles of load_data: full loads also the positions (lazily), generation only the metadata
+FULL_PROFILE = "full"
+GENERATION_PROFILE = "generation"
+
+
 class GenomeMeaning(object):
     """
     Class representing what every position in the genome means
 
     It loads all the tag and subtag used in the system and it loads also the location of all the objects
     in the map
+    The tags are loaded immediately, the location of the objects the first time name_and_position is used
     """
 
     def __init__(self, logger=None):
@@ -41,14 +46,44 @@ class GenomeMeaning(object):
         self.number_typologies = 0
         self.name_typologies = []
         self.name_and_details = {}
-        self.name_and_position = None
+        self._name_and_position = None
         self.list_of_names_per_genome = []
         self.link_main_obj_and_small_objs = {}
         self._features = 0
         self.order_name_and_position = None
         self.method_mmap = False
+        self._profile = FULL_PROFILE
+        # csv file, accepted tags and others tag of every typology, read on demand
+        self._csv_files = {}
 
-    def load_data(self, test, performance=True):
+    @property
+    def name_and_position(self):
+        """
+        Location of all the objects in the map, loaded the first time they are needed
+        :return: memmap (mmap method) or dict typology -> dict tag -> array of positions
+        """
+        if self._name_and_position is None and (self.method_mmap or len(self._csv_files) > 0):
+            if self._profile == GENERATION_PROFILE:
+                raise ValueError("Positions of the objects are not available with the generation profile")
+            self._load_positions()
+        return self._name_and_position
+
+    def _load_positions(self):
+        """
+        Load the location of all the objects, from the memory mapped file or from the csv files
+        :return:
+        """
+        if self.method_mmap:
+            self._name_and_position = load_data_bundle().open(name="name_and_position")
+        else:
+            self._name_and_position = {}
+            for lowercase_name, (name_file, list_word_accepted, others_name) in self._csv_files.items():
+                # parsed only if its binary cache is missing or old
+                dic = load_positions(name_file=name_file, list_word_accepted=list_word_accepted,
+                                     others_name=others_name)
+                self._name_and_position.update({lowercase_name: dic})
+
+    def load_data(self, test, performance=True, profile=FULL_PROFILE):
         """
         Load location data
 
@@ -59,9 +94,15 @@ class GenomeMeaning(object):
 
         If there are different tag in the file that are not in the Phenotype file, the tag is changed into others
 
+        Only the metadata is read here, the positions when name_and_position is used.
+        With the generation profile the positions are never read
+
         :param test: if test is true, test files are loaded (with fewer elements)
+        :param performance: if true, the details of the phenotype are released after loading
+        :param profile: FULL_PROFILE or GENERATION_PROFILE
         :return:
         """
+        self._profile = profile
         # loading coordinates
         phenotype_file = args.data_path + "/Phenotype"
         with open(phenotype_file, 'r') as f:
@@ -78,13 +119,13 @@ class GenomeMeaning(object):
                     {k.lower(): [x.lower() if x.lower() != "others" else "others_" + k.lower() for x in el[k]]})
 
 
-        self._log.debug("Typology loaded {}".format(self.name_typologies))
-
-        mmap_file = "{}/name_and_position.dat".format(args.data_path)
-        if os.path.isfile(mmap_file):
-            self._log.debug("mmap file exist, loading it")
+        if self._log is not None:
+            self._log.debug("Typology loaded {}".format(self.name_typologies))
 
-            self.name_and_position = np.memmap(mmap_file, dtype='float32', mode='r', shape=(56, 938737, 2))
+        bundle = load_data_bundle()
+        if bundle.has(name="name_and_position"):
+            if self._log is not None:
+                self._log.debug("mmap file exist, it will be loaded when needed")
 
             with open('{}/order_on_mmap.pickle'.format(args.data_path), 'rb') as handle:
                 self.order_name_and_position = pickle.load(handle)
@@ -93,7 +134,6 @@ class GenomeMeaning(object):
                 self.name_typologies = pickle.load(handle)
             self.method_mmap = True
         else:
-            self.name_and_position = {}
             for name in self.name_typologies:
                 lowercase_name = name.lower()
                 root = os.path.dirname(os.path.abspath(__file__))
@@ -114,28 +154,14 @@ class GenomeMeaning(object):
                         self.link_main_obj_and_small_objs.update({word: name})
                     self.list_of_names_per_genome.extend(list_word_accepted_fixed)
 
-                    # file exist
-                    with open(name_file) as csvfile:
-                        reader = csv.DictReader(csvfile)
-                        dic = {}
-
-                        for row in reader:
-                            name_element = row["names"].lower()
-
-                            if name_element in list_word_accepted:
-                                okay_id = name_element
-                            else:
-                                okay_id = "others_" + name
-
-                            if row["x"] != "":
-                                dic.setdefault(okay_id, []).append((float(row["x"]), float(row["y"])))
-
-                        self.name_and_position.update({lowercase_name: dic})
+                    self._csv_files[lowercase_name] = (name_file, list_word_accepted, "others_" + name)
                 else:
-                    self._log.debug("File {} not present in folder. Please provide it".format(name_file))
+                    if self._log is not None:
+                        self._log.debug("File {} not present in folder. Please provide it".format(name_file))
                     raise ValueError("File {} not present in folder. Please provide it".format(name_file))
 
-        self._log.info("Coordinates loaded!")
+        if self._log is not None:
+            self._log.info("Coordinates metadata loaded!")
         self._log = None
 
         if performance:
@@ -21,6 +21,7 @@ import numpy as np
 import tqdm as tqdm
 
 from src.Settings.args import args
+from src.Utils.Resampling import step_length_table
 
 
 class LoadAPF(object):
@@ -30,10 +31,30 @@ class LoadAPF(object):
     def __init__(self, path, logger=None):
         self._path = path
         self._log = logger
-        self.apf = None
+        self._apf = None
+        self._metadata_only = False
+        self.shape = None
         self.coordinates = {}
         self.x_values = []
         self.y_values = []
+        self.step_lengths = None
+
+    @property
+    def apf(self):
+        """
+        The APF as DataFrame
+        If only the metadata has been loaded, the file is read the first time the values are needed
+        :return: DataFrame
+        """
+        if self._apf is None and self._metadata_only:
+            self.load_apf_only_routing_system()
+        return self._apf
+
+    @apf.setter
+    def apf(self, value):
+        self._apf = value
+        self._metadata_only = False
+        self.shape = None if value is None else value.shape
 
     def load_apf_only_routing_system(self):
         """
@@ -44,10 +65,32 @@ class LoadAPF(object):
             self._log.debug("Loading APF from file...")
         # self.apf = pd.read_feather(self._path)
         import feather
-        self.apf = feather.read_dataframe(self._path)
+        self._apf = feather.read_dataframe(self._path)
+        self._metadata_only = False
+        self.shape = self._apf.shape
         # self.apf.info(verbose=False)
         if self._log is not None:
-            self._log.info("APF with routing system loaded {}".format(self.apf.shape))
+            self._log.info("APF with routing system loaded {}".format(self._apf.shape))
+
+    def load_apf_metadata(self):
+        """
+        Read only the shape of the APF, without loading its values
+        The shape comes from the arrow schema and from one memory mapped column
+        Old feather files (version 1) have no arrow footer and they are loaded completely
+        :return:
+        """
+        import pyarrow
+        import pyarrow.feather
+        try:
+            schema = pyarrow.ipc.open_file(pyarrow.memory_map(self._path)).schema
+        except pyarrow.ArrowInvalid:
+            self.load_apf_only_routing_system()
+            return
+        first_column = pyarrow.feather.read_table(self._path, columns=[schema.names[0]], memory_map=True)
+        self.shape = (first_column.num_rows, len(schema.names))
+        self._metadata_only = True
+        if self._log is not None:
+            self._log.info("APF metadata loaded {}".format(self.shape))
 
     def save_apf(self, path_file="apf.csv"):
         """
@@ -103,10 +146,12 @@ class LoadAPF(object):
             "west": args.west}
 
         # resolution image
-        x_max = self.apf.shape[0]
-        y_max = self.apf.shape[1]
+        x_max = self.shape[0]
+        y_max = self.shape[1]
 
         # creation of the real coordinates
         # now the index correspond to a real coordinate
         self.x_values = np.linspace(start=self.coordinates["west"], stop=self.coordinates["east"], num=x_max)
-        self.y_values = np.linspace(start=self.coordinates["south"], stop=self.coordinates["north"], num=y_max)
\ No newline at end of file
+        self.y_values = np.linspace(start=self.coordinates["south"], stop=self.coordinates["north"], num=y_max)
+        # metres moved in every direction from every row, used instead of haversine during the generation
+        self.step_lengths = step_length_table(x_values=self.x_values, y_values=self.y_values)
\ No newline at end of file
@@ -0,0 +1,129 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import csv
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def _file_hash(name_file):
+    """
+    sha1 of the content of the file
+    :param name_file: file to read
+    :return: hex digest
+    """
+    hash_function = hashlib.sha1()
+    with open(name_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hash_function.update(chunk)
+    return hash_function.hexdigest()
+
+
+def _write_index(index_file, index):
+    """
+    Write the index of the cache through a temporary file, a reader never sees it half written
+    :param index_file: json file of the index
+    :param index: dict to store
+    :return:
+    """
+    with open(index_file + ".tmp", 'w') as f:
+        json.dump(index, f)
+    os.replace(index_file + ".tmp", index_file)
+
+
+def read_positions_csv(name_file, list_word_accepted, others_name):
+    """
+    Parse the csv of one typology, grouping the positions per tag
+    Names not in the accepted list become the others tag, rows without coordinates are skipped
+    :param name_file: csv with names, x and y columns
+    :param list_word_accepted: tags accepted for this typology
+    :param others_name: tag of the names not accepted
+    :return: tags, offsets (tag i is positions[offsets[i]:offsets[i + 1]]) and float64 positions (objects x 2)
+    """
+    dic = {}
+    with open(name_file) as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            name_element = row["names"].lower()
+
+            if name_element in list_word_accepted:
+                okay_id = name_element
+            else:
+                okay_id = others_name
+
+            if row["x"] != "":
+                dic.setdefault(okay_id, []).append((float(row["x"]), float(row["y"])))
+
+    tags = list(dic.keys())
+    offsets = np.zeros(len(tags) + 1, dtype=np.int64)
+    np.cumsum([len(dic[tag]) for tag in tags], out=offsets[1:])
+    positions = np.array([position for tag in tags for position in dic[tag]], dtype=np.float64).reshape(-1, 2)
+    return tags, offsets, positions
+
+
+def load_positions(name_file, list_word_accepted, others_name):
+    """
+    Load the positions of one typology from the binary cache of its csv
+    The csv is parsed once: positions are stored in <csv>.positions.npy and the tags in <csv>.index.json.
+    The cache is rebuilt if the csv changes (size, or modification time and content) or if the accepted tags change
+    :param name_file: csv with names, x and y columns
+    :param list_word_accepted: tags accepted for this typology
+    :param others_name: tag of the names not accepted
+    :return: dict tag -> read only array of positions (objects x 2)
+    """
+    index_file = "{}.index.json".format(name_file)
+    positions_file = "{}.positions.npy".format(name_file)
+    stat = os.stat(name_file)
+
+    index = None
+    if os.path.isfile(index_file) and os.path.isfile(positions_file):
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+        if index["accepted"] != list(list_word_accepted) or index["others"] != others_name or \
+                index["size"] != stat.st_size:
+            index = None
+        elif index["mtime"] != stat.st_mtime:
+            # touched but maybe not modified
+            if index["sha1"] == _file_hash(name_file=name_file):
+                index["mtime"] = stat.st_mtime
+                _write_index(index_file=index_file, index=index)
+            else:
+                index = None
+
+    if index is None:
+        tags, offsets, positions = read_positions_csv(name_file=name_file, list_word_accepted=list_word_accepted,
+                                                      others_name=others_name)
+        # the old index goes first and the new one is written last, a cache without it is rebuilt
+        if os.path.isfile(index_file):
+            os.remove(index_file)
+        with open(positions_file + ".tmp", 'wb') as f:
+            np.save(f, positions)
+        os.replace(positions_file + ".tmp", positions_file)
+        index = {"mtime": stat.st_mtime, "size": stat.st_size, "sha1": _file_hash(name_file=name_file),
+                 "accepted": list(list_word_accepted), "others": others_name, "tags": tags,
+                 "offsets": offsets.tolist()}
+        _write_index(index_file=index_file, index=index)
+
+    offsets = index["offsets"]
+    if offsets[-1] == 0:
+        positions = np.zeros((0, 2), dtype=np.float64)
+    else:
+        positions = np.load(positions_file, mmap_mode='r')
+    return {tag: positions[offsets[i]:offsets[i + 1]] for i, tag in enumerate(index["tags"])}
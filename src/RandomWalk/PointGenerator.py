@@ -15,6 +15,8 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
+from src.Helpers.Road.RoadGraph import NO_NODE
+from src.RandomWalk.RandomWalkBatched import random_walk_standard_batched, random_walk_no_visited_batched
 from src.RandomWalk.RandomWalkFitness import random_walk_weighted_fitness
 from src.RandomWalk.RandomWalkFitnessNoVisited import random_walk_weighted_fitness_no_visited
 from src.RandomWalk.RandomWalkNoVisited import random_walk_no_visited
@@ -40,8 +42,9 @@ class PointGenerator(object):
         :param K: constant for the computation of the charge
         :param current_node: current node
         :param apf: apf
-        :return: path generated
+        :return: path generated (node ids in the road graph)
         """
+        current_node = self._to_node_id(point=current_node)
         if self._type == 0:
             return random_walk_standard(apf=apf, start=current_node, distance_target=total_distance,
                                         pre_matrix=self.pre_matrix)
@@ -62,3 +65,41 @@ class PointGenerator(object):
                                                            pre_matrix=self.pre_matrix, genome=genome, K=K)
         else:
             raise ValueError("type not implemented")
+
+    def _to_node_id(self, point):
+        """
+        Return the id in the road graph of the starting point
+        A starting point that is not on a road is moved to the closest road node
+        :param point: starting point
+        :return: node id
+        """
+        node = self.pre_matrix.road_graph.nearest_node(x=point.x, y=point.y)
+        if node == NO_NODE:
+            raise ValueError("The road graph has no nodes")
+        return node
+
+    def supports_batch(self):
+        """
+        Check if the method chosen can generate many paths at the same time
+        :return: True if get_paths can be used, False otherwise
+        """
+        return self._type in (0, 1)
+
+    def get_paths(self, total_distance, starts, apf, random_states):
+        """
+        Return many paths generated together with the batched version of the method chosen
+        :param total_distance: total distance to travel
+        :param starts: list of starting nodes
+        :param apf: apf
+        :param random_states: numpy RandomState of every walker
+        :return: node ids and length of every path
+        """
+        starts = [self._to_node_id(point=point) for point in starts]
+        if self._type == 0:
+            return random_walk_standard_batched(apf=apf, starts=starts, distance_target=total_distance,
+                                                pre_matrix=self.pre_matrix, random_states=random_states)
+        elif self._type == 1:
+            return random_walk_no_visited_batched(apf=apf, starts=starts, distance_target=total_distance,
+                                                  pre_matrix=self.pre_matrix, random_states=random_states)
+        else:
+            raise ValueError("type not implemented in batch mode")
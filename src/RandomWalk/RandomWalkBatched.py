@@ -0,0 +1,124 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+from src.Utils.VisitedSet import VisitedKeys
+
+
+def walker_random_states(random_seed, idxs):
+    """
+    One RandomState per walker, keyed on the random seed and on the index of its starting point
+    A walker draws the same numbers whatever chunk it is generated in,
+    so the trajectories do not depend on the batch size
+    :param random_seed: random seed, None for fresh entropy
+    :param idxs: indexes of the starting points
+    :return: list of RandomState, one per index
+    """
+    if random_seed is None:
+        return [np.random.RandomState() for _ in idxs]
+    return [np.random.RandomState(np.random.SeedSequence((random_seed, idx)).generate_state(4)) for idx in idxs]
+
+
+def _random_walk_batched(graph, starts, distance_target, no_visited, random_states):
+    """
+    Move all the walkers together on the road graph, one step for all of them at every iteration
+    :param graph: road graph
+    :param starts: node ids of the starting points
+    :param distance_target: how many timestep max to generate
+    :param no_visited: True if the already visited nodes are not available anymore
+    :param random_states: numpy RandomState of every walker, used to draw its choices
+    :return: node ids and length of every path
+    """
+    number_walkers = len(starts)
+    # every walker draws all its uniforms from its own stream, one per step even after it stops
+    uniforms = np.array([state.random_sample(distance_target) for state in random_states],
+                        dtype=np.float64).reshape(number_walkers, distance_target)
+    paths = np.zeros((number_walkers, distance_target + 1), dtype=np.int32)
+    paths[:, 0] = starts
+    lengths = np.ones(number_walkers, dtype=np.int64)
+
+    current_nodes = paths[:, 0].copy()
+    walkers = np.arange(number_walkers)
+    # walker that hit a dead end stop there
+    active = np.ones(number_walkers, dtype=bool)
+    directions = np.arange(8)
+    last_edge = len(graph.indices) - 1
+
+    visited = None
+    if no_visited:
+        visited = VisitedKeys(expected_keys=number_walkers * (distance_target + 1))
+        visited.add(walkers * graph.number_of_nodes + current_nodes)
+
+    for step in range(1, distance_target + 1):
+        # the neighbours of every walker, padded to eight
+        first_edge = graph.indptr[current_nodes]
+        valid = directions < graph.degrees(nodes=current_nodes)[:, None]
+        valid &= active[:, None]
+        candidates = graph.indices[np.minimum(first_edge[:, None] + directions, last_edge)]
+        if no_visited:
+            keys = walkers[:, None] * graph.number_of_nodes + candidates
+            valid[valid] = ~visited.contains(keys=keys[valid])
+
+        number_valid = valid.sum(axis=1)
+        active &= number_valid > 0
+        if not active.any():
+            break
+
+        # uniform choice among the valid neighbours, one draw per walker
+        choices = (uniforms[:, step - 1] * number_valid).astype(np.int64)
+        chosen = np.argmax(np.cumsum(valid, axis=1) > choices[:, None], axis=1)
+
+        moving = walkers[active]
+        current_nodes[moving] = candidates[moving, chosen[moving]]
+        paths[moving, step] = current_nodes[moving]
+        lengths[moving] += 1
+        if no_visited:
+            visited.add(keys=moving * graph.number_of_nodes + current_nodes[moving])
+
+    return paths, lengths
+
+
+def random_walk_standard_batched(apf, starts, distance_target, pre_matrix, random_states):
+    """
+    Generate many trajectories at the same time using the random walk
+    Same behaviour of random_walk_standard, but all the walkers move together using arrays of node ids
+    If a walker has no road neighbours, its generation stops
+    :param apf: shape of the artificial potential field
+    :param starts: node ids of the starting points
+    :param distance_target: how many timestep max to generate
+    :param pre_matrix: preloaded attraction values
+    :param random_states: numpy RandomState of every walker (see walker_random_states)
+    :return: node ids and length of every path
+    """
+    return _random_walk_batched(graph=pre_matrix.road_graph, starts=starts, distance_target=distance_target,
+                                no_visited=False, random_states=random_states)
+
+
+def random_walk_no_visited_batched(apf, starts, distance_target, pre_matrix, random_states):
+    """
+    Generate many trajectories at the same time using the random walk with no visited checks on
+    Same behaviour of random_walk_no_visited, every walker has its own set of visited nodes
+    :param apf: shape of the artificial potential field
+    :param starts: node ids of the starting points
+    :param distance_target: how many timestep max to generate
+    :param pre_matrix: preloaded attraction values
+    :param random_states: numpy RandomState of every walker (see walker_random_states)
+    :return: node ids and length of every path
+    """
+    return _random_walk_batched(graph=pre_matrix.road_graph, starts=starts, distance_target=distance_target,
+                                no_visited=True, random_states=random_states)
@@ -15,13 +15,12 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-import copy
 import time
 
 import numpy as np
 
+from src.Helpers.Fitness.TrajectoryFeatures import TrajectoryFeatures
 from src.Helpers.Fitness.ValueGraphFitness import convert
-from src.Utils.Funcs import list_neighbours, compute_fintess_trajectory
 
 
 def random_walk_weighted_fitness(apf, start, distance_target, pre_matrix, genome, K):
@@ -37,34 +36,35 @@ def random_walk_weighted_fitness(apf, start, distance_target, pre_matrix, genome
     move to the chosen node
     repeat
     :param apf: artificial potential field, needed to check the neighbour node
-    :param start: starting point
+    :param start: starting node (id in the road graph)
     :param distance_target: how many timestep max to generate
     :param pre_matrix: preloaded attraction values
     :param genome: multiplier for the attraction
     :param K: constant for the coulomb equation
-    :return: list of nodes -> final trajectory
+    :return: list of node ids -> final trajectory
     """
+    graph = pre_matrix.road_graph
+    # charge of every road node for this genome
+    charge_field = pre_matrix.get_charge_field(genome=genome, K=K)
     # start from the first point
     final_trajectory = [start]
+    # the fitness works on the matrix coordinates, features updated point after point
+    features = TrajectoryFeatures(start=graph.points(ids=[start])[0])
 
     current_node = start
     # generate distance_target steps
     for step in range(distance_target):
         time_start = time.time()
         # Generate children
-        points = list_neighbours(x_value=current_node.x, y_value=current_node.y, apf=apf)
-        points_on_the_street = pre_matrix.keep_only_points_on_street(points=points)
+        points_on_the_street = graph.neighbours(node=current_node)
+        points_on_the_street_coordinates = graph.points(ids=points_on_the_street)
 
         total_charges = []
-        for node in points_on_the_street:
-            tra_moved_so_far = copy.deepcopy(final_trajectory)
-            tra_moved_so_far.append(node)
-
-            total_charge, _ = compute_fintess_trajectory(tra_moved_so_far=tra_moved_so_far)
+        for node in points_on_the_street_coordinates:
+            total_charge, _ = features.fitness_if_moving_to(point=node)
             total_charges.append(total_charge)
 
-        total_charges_attraction = [pre_matrix.return_charge_from_point(current_position=node, genome=genome, K=K)
-                                    for node in points_on_the_street]
+        total_charges_attraction = charge_field[points_on_the_street].astype(np.float64)
 
         total_charges = np.array([convert(old_max=700, old_min=-750, new_max=10, new_min=1,
                                  old_value=el) for el in total_charges])
@@ -76,7 +76,9 @@ def random_walk_weighted_fitness(apf, start, distance_target, pre_matrix, genome
         total_charges = np.array([el / sum(real_total_charge_normalised) for el in real_total_charge_normalised])
 
         # random walk, select randomly where to go
-        current_node = np.random.choice(a=points_on_the_street, size=1, p=total_charges)[0]
+        index_chosen = np.random.choice(a=len(points_on_the_street), size=1, p=total_charges)[0]
+        current_node = int(points_on_the_street[index_chosen])
         final_trajectory.append(current_node)
+        features.append(point=points_on_the_street_coordinates[index_chosen])
 
     return final_trajectory
@@ -15,12 +15,10 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-import copy
-
 import numpy as np
 
+from src.Helpers.Fitness.TrajectoryFeatures import TrajectoryFeatures
 from src.Helpers.Fitness.ValueGraphFitness import convert
-from src.Utils.Funcs import list_neighbours, compute_fintess_trajectory
 
 
 def random_walk_weighted_fitness_no_visited(apf, start, distance_target, pre_matrix, genome, K):
@@ -38,43 +36,44 @@ def random_walk_weighted_fitness_no_visited(apf, start, distance_target, pre_mat
     move to the chosen node
     repeat
     :param apf: artificial potential field, needed to check the neighbour node
-    :param start: starting point
+    :param start: starting node (id in the road graph)
     :param distance_target: how many timestep max to generate
     :param pre_matrix: preloaded attraction values
     :param genome: multiplier for the attraction
     :param K: constant for the coulomb equation
-    :return: list of nodes -> final trajectory
+    :return: list of node ids -> final trajectory
     """
-    already_visited = {}
+    graph = pre_matrix.road_graph
+    # charge of every road node for this genome
+    charge_field = pre_matrix.get_charge_field(genome=genome, K=K)
+    already_visited = pre_matrix.get_visited_nodes()
+    already_visited.add(nodes=start)
     # start from the first point
     final_trajectory = [start]
-    already_visited["{}-{}".format(start.x, start.y)] = 1
+    # the fitness works on the matrix coordinates, features updated point after point
+    features = TrajectoryFeatures(start=graph.points(ids=[start])[0])
 
     current_node = start
     # generate distance_target steps
     for step in range(distance_target):
         # Generate children
-        points = list_neighbours(x_value=current_node.x, y_value=current_node.y, apf=apf)
-        points_on_the_street = pre_matrix.keep_only_points_on_street(points=points)
+        points_on_the_street = graph.neighbours(node=current_node)
 
         # check if nodes are already visited
-        real_points_on_the_street = [node for node in points_on_the_street if
-                                     "{}-{}".format(node.x, node.y) not in already_visited]
+        real_points_on_the_street = points_on_the_street[~already_visited.contains(nodes=points_on_the_street)]
 
         if len(real_points_on_the_street) == 0:
             break
+        real_points_on_the_street_coordinates = graph.points(ids=real_points_on_the_street)
 
         total_charges = []
-        for node in real_points_on_the_street:
-            tra_moved_so_far = copy.deepcopy(final_trajectory)
-            tra_moved_so_far.append(node)
-            total_charge, _ = compute_fintess_trajectory(tra_moved_so_far=tra_moved_so_far)
+        for node in real_points_on_the_street_coordinates:
+            total_charge, _ = features.fitness_if_moving_to(point=node)
             total_charges.append(total_charge)
 
         total_charges = [convert(old_max=700, old_min=-750, new_max=10, new_min=1,
                                  old_value=el) for el in total_charges]
-        total_charges_attraction = [pre_matrix.return_charge_from_point(current_position=node, genome=genome, K=K)
-                                    for node in real_points_on_the_street]
+        total_charges_attraction = charge_field[real_points_on_the_street].astype(np.float64)
 
         total_charges_attraction = np.array([convert(old_max=10000, old_min=0, new_max=10, new_min=1,
                                                      old_value=el) for el in total_charges_attraction])
@@ -84,8 +83,10 @@ def random_walk_weighted_fitness_no_visited(apf, start, distance_target, pre_mat
         total_charges = np.array([el / sum(real_total_charge_normalised) for el in real_total_charge_normalised])
 
         # random walk, select randomly where to go
-        current_node = np.random.choice(a=real_points_on_the_street, size=1, p=total_charges)[0]
+        index_chosen = np.random.choice(a=len(real_points_on_the_street), size=1, p=total_charges)[0]
+        current_node = int(real_points_on_the_street[index_chosen])
         final_trajectory.append(current_node)
-        already_visited["{}-{}".format(current_node.x, current_node.y)] = 1
+        features.append(point=real_points_on_the_street_coordinates[index_chosen])
+        already_visited.add(nodes=current_node)
 
     return final_trajectory
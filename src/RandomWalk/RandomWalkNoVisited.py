@@ -17,8 +17,6 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import numpy as np
 
-from src.Utils.Funcs import list_neighbours
-
 
 def random_walk_no_visited(apf, start, distance_target, pre_matrix):
     """
@@ -31,32 +29,32 @@ def random_walk_no_visited(apf, start, distance_target, pre_matrix):
     move to the chosen node
     repeat
     :param apf: artificial potential field, needed to check the neighbour node
-    :param start: starting point
+    :param start: starting node (id in the road graph)
     :param distance_target: how many timestep max to generate
     :param pre_matrix: preloaded attraction values
-    :return: list of nodes -> final trajectory
+    :return: list of node ids -> final trajectory
     """
-    already_visited = {}
+    graph = pre_matrix.road_graph
+    already_visited = pre_matrix.get_visited_nodes()
+    already_visited.add(nodes=start)
     # start from the first point
     final_trajectory = [start]
-    already_visited["{}-{}".format(start.x, start.y)] = 1
 
     current_node = start
     # generate distance_target steps
     for step in range(distance_target):
         # Generate children
-        points = list_neighbours(x_value=current_node.x, y_value=current_node.y, apf=apf)
-        points_on_the_street = pre_matrix.keep_only_points_on_street(points=points)
+        points_on_the_street = graph.neighbours(node=current_node)
 
         # check if nodes are already visited
-        real_points_on_the_street = [node for node in points_on_the_street if "{}-{}".format(node.x, node.y) not in already_visited]
+        real_points_on_the_street = points_on_the_street[~already_visited.contains(nodes=points_on_the_street)]
 
         if len(real_points_on_the_street) == 0:
             break
         # random walk, select randomly where to go
         index_max = np.random.random_integers(low=0, high=len(real_points_on_the_street) - 1)
-        current_node = real_points_on_the_street[index_max]
+        current_node = int(real_points_on_the_street[index_max])
         final_trajectory.append(current_node)
-        already_visited["{}-{}".format(current_node.x, current_node.y)] = 1
+        already_visited.add(nodes=current_node)
 
     return final_trajectory
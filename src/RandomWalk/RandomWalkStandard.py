@@ -17,8 +17,6 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import numpy as np
 
-from src.Utils.Funcs import list_neighbours
-
 
 def random_walk_standard(apf, start, distance_target, pre_matrix):
     """
@@ -29,11 +27,12 @@ def random_walk_standard(apf, start, distance_target, pre_matrix):
     move to the chosen node
     repeat
     :param apf: artificial potential field, needed to check the neighbour node
-    :param start: starting point
+    :param start: starting node (id in the road graph)
     :param distance_target: how many timestep max to generate
     :param pre_matrix: preloaded attraction values
-    :return: list of nodes -> final trajectory
+    :return: list of node ids -> final trajectory
     """
+    graph = pre_matrix.road_graph
     # start from the first point
     final_trajectory = [start]
 
@@ -41,13 +40,12 @@ def random_walk_standard(apf, start, distance_target, pre_matrix):
     # generate distance_target steps
     for step in range(distance_target):
         # Generate children
-        points = list_neighbours(x_value=current_node.x, y_value=current_node.y, apf=apf)
-        points_on_the_street = pre_matrix.keep_only_points_on_street(points=points)
+        points_on_the_street = graph.neighbours(node=current_node)
 
         # random walk, select randomly where to go
         index_max = np.random.random_integers(low=0, high=len(points_on_the_street) - 1)
 
-        current_node = points_on_the_street[index_max]
+        current_node = int(points_on_the_street[index_max])
         final_trajectory.append(current_node)
 
     return final_trajectory
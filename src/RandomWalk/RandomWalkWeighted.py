@@ -17,7 +17,7 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import numpy as np
 
-from src.Utils.Funcs import list_neighbours
+from src.Helpers.Road.RoadGraph import NO_NODE
 
 
 def random_walk_weighted(apf, start, distance_target, pre_matrix, genome, K):
@@ -30,30 +30,30 @@ def random_walk_weighted(apf, start, distance_target, pre_matrix, genome, K):
     compute the random next node
     move to the chosen node
     repeat
+    The normalised attractions of every node are precomputed in the alias table,
+    so every step is one uniform draw and one lookup
     :param apf: artificial potential field, needed to check the neighbour node
-    :param start: starting point
+    :param start: starting node (id in the road graph)
     :param distance_target: how many timestep max to generate
     :param pre_matrix: preloaded attraction values
     :param genome: multiplier for the attraction
     :param K: constant for the coulomb equation
-    :return: list of nodes -> final trajectory
+    :return: list of node ids -> final trajectory
     """
+    # transition tables of every road node for this genome
+    alias_table = pre_matrix.get_alias_table(genome=genome, K=K)
     # start from the first point
     final_trajectory = [start]
 
     current_node = start
+    uniforms = np.random.random_sample(distance_target)
     # generate distance_target steps
     for step in range(distance_target):
-        # Generate children
-        points = list_neighbours(x_value=current_node.x, y_value=current_node.y, apf=apf)
-        points_on_the_street = pre_matrix.keep_only_points_on_street(points=points)
-
-        total_charges = [pre_matrix.return_charge_from_point(current_position=node, genome=genome, K=K) for node in points_on_the_street]
-
-        total_charges = np.array([el/sum(total_charges) for el in total_charges])
-
         # random walk, select randomly where to go
-        current_node = np.random.choice(a=points_on_the_street, size=1, p=total_charges)[0]
+        next_node = alias_table.sample(node=current_node, uniform=uniforms[step])
+        if next_node == NO_NODE:
+            break
+        current_node = next_node
         final_trajectory.append(current_node)
 
     return final_trajectory
@@ -34,8 +34,6 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import numpy as np
 
-from src.Utils.Funcs import list_neighbours
-
 
 def random_walk_weighted_no_visited(apf, start, distance_target, pre_matrix, genome, K):
     """
@@ -50,38 +48,39 @@ def random_walk_weighted_no_visited(apf, start, distance_target, pre_matrix, gen
     move to the chosen node
     repeat
     :param apf: artificial potential field, needed to check the neighbour node
-    :param start: starting point
+    :param start: starting node (id in the road graph)
     :param distance_target: how many timestep max to generate
     :param pre_matrix: preloaded attraction values
     :param genome: multiplier for the attraction
     :param K: constant for the coulomb equation
-    :return: list of nodes -> final trajectory
+    :return: list of node ids -> final trajectory
     """
-    already_visited = {}
+    graph = pre_matrix.road_graph
+    # charge of every road node for this genome
+    charge_field = pre_matrix.get_charge_field(genome=genome, K=K)
+    already_visited = pre_matrix.get_visited_nodes()
+    already_visited.add(nodes=start)
     # start from the first point
     final_trajectory = [start]
-    already_visited["{}-{}".format(start.x, start.y)] = 1
 
     current_node = start
     # generate distance_target steps
     for step in range(distance_target):
         # Generate children
-        points = list_neighbours(x_value=current_node.x, y_value=current_node.y, apf=apf)
-        points_on_the_street = pre_matrix.keep_only_points_on_street(points=points)
+        points_on_the_street = graph.neighbours(node=current_node)
 
         # check if nodes are already visited
-        real_points_on_the_street = [node for node in points_on_the_street if
-                                     "{}-{}".format(node.x, node.y) not in already_visited]
+        real_points_on_the_street = points_on_the_street[~already_visited.contains(nodes=points_on_the_street)]
 
         if len(real_points_on_the_street) == 0:
             break
 
-        total_charges = [pre_matrix.return_charge_from_point(current_position=node, genome=genome, K=K) for node in real_points_on_the_street]
-        total_charges = np.array([el / sum(total_charges) for el in total_charges])
+        total_charges = charge_field[real_points_on_the_street].astype(np.float64)
+        total_charges = total_charges / np.sum(total_charges)
 
         # random walk, select randomly where to go
-        current_node = np.random.choice(a=real_points_on_the_street, size=1, p=total_charges)[0]
+        current_node = int(np.random.choice(a=real_points_on_the_street, size=1, p=total_charges)[0])
         final_trajectory.append(current_node)
-        already_visited["{}-{}".format(current_node.x, current_node.y)] = 1
+        already_visited.add(nodes=current_node)
 
     return final_trajectory
@@ -41,8 +41,20 @@ def prepare_parser():
     # fitness settings
     parser.add_argument("--point_distance", type=eval, help="Select witch term to use for fitness only distance to "
                                                             "central point")
+    parser.add_argument("--fitness_exact", action="store_true", help="evaluate the fitness landscape with the hulls "
+                                                                     "instead of the precomputed rasters")
+    parser.add_argument("--fitness_resolution", type=int, default=512, help="points per axis of the fitness "
+                                                                            "landscape rasters")
 
     parser.add_argument("--random_seed", type=int, default=422, help="random seed")
+    parser.add_argument("--grid", default=None, help="json file with the lists of genomes, type_random_walk, "
+                                                     "point_distance, random_seed and total_distance_to_travel "
+                                                     "to run, missing ones use the values above")
+    parser.add_argument("--batch_size", type=int, default=1000, help="how many walkers move together with the batched "
+                                                                     "random walk (types 0 and 1). 0 disables it. "
+                                                                     "Every walker has its own random stream, so the "
+                                                                     "output does not depend on the size, but it "
+                                                                     "differs from the output with 0")
     return parser
 
 
@@ -21,6 +21,10 @@ from scipy.spatial import distance
 from src.Helpers.Fitness.ValueGraphFitness import get_fitness_value
 from src.Utils.Point import Point
 
+# offsets of the eight neighbours, same order used by list_neighbours
+NEIGHBOURS_X_OFFSET = np.array([-1, 0, 1, 1, 1, 0, -1, -1], dtype=np.int32)
+NEIGHBOURS_Y_OFFSET = np.array([1, 1, 1, 0, -1, -1, -1, 0], dtype=np.int32)
+
 
 def list_neighbours(x_value, y_value, apf, list_already_visited=None):
     """
@@ -0,0 +1,40 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+# same radius used by the haversine package
+AVG_EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_array(points1, points2):
+    """
+    NumPy version of haversine, same formula and same (first value, second value) convention
+    The two arrays are broadcast: (N x 2) with (N x 2) gives N distances,
+    (N x 1 x 2) with (1 x M x 2) gives the (N x M) matrix of distances
+    :param points1: array of points, last dimension of size two
+    :param points2: array of points, last dimension of size two
+    :return: distances in kilometres
+    """
+    points1 = np.radians(np.asarray(points1, dtype=np.float64))
+    points2 = np.radians(np.asarray(points2, dtype=np.float64))
+    lat1 = points1[..., 0]
+    lat2 = points2[..., 0]
+    lat = lat2 - lat1
+    lng = points2[..., 1] - points1[..., 1]
+    d = np.sin(lat * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(lng * 0.5) ** 2
+    return AVG_EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(d))
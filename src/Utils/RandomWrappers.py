@@ -31,6 +31,10 @@ def random_wrapper_lognorm(mean, std):
     return np.random.lognormal(mean, std)
 
 
+def random_wrapper_lognorm_vector(mean, std, elements):
+    return np.random.lognormal(mean, std, size=elements)
+
+
 def random_wrapper_randint(lower_bound, upper_bound):
     return random.randint(lower_bound, upper_bound)
 
@@ -0,0 +1,117 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+from src.Utils.Funcs import NEIGHBOURS_X_OFFSET, NEIGHBOURS_Y_OFFSET
+from src.Utils.GreatCircle import haversine_array
+
+# speculative one-cell moves checked together before falling back to searchsorted
+WINDOW = 256
+
+# direction (position in NEIGHBOURS_X_OFFSET) of the move with offset (dx + 1, dy + 1), 0 for no move
+DIRECTION_OF_OFFSET = np.zeros((3, 3), dtype=np.int64)
+DIRECTION_OF_OFFSET[NEIGHBOURS_X_OFFSET + 1, NEIGHBOURS_Y_OFFSET + 1] = np.arange(len(NEIGHBOURS_X_OFFSET))
+
+
+def step_length_table(x_values, y_values):
+    """
+    Length in metres of the move in every direction (same order of list_neighbours) from every x row
+    The grid is regular, so with the (x value, y value) convention of the haversine calls of the generation
+    the length of a move depends only on the x row and on the direction
+    :param x_values: x values of the grid
+    :param y_values: y values of the grid
+    :return: float64 matrix (x rows x 8), NaN for the moves that leave the grid
+    """
+    x_values = np.asarray(x_values, dtype=np.float64)
+    y_values = np.asarray(y_values, dtype=np.float64)
+    y_step = (y_values[-1] - y_values[0]) / (len(y_values) - 1) if len(y_values) > 1 else 0.0
+    y_reference = y_values[len(y_values) // 2]
+    rows = np.arange(len(x_values))
+    table = np.full((len(x_values), len(NEIGHBOURS_X_OFFSET)), np.nan, dtype=np.float64)
+    for k in range(len(NEIGHBOURS_X_OFFSET)):
+        targets = rows + NEIGHBOURS_X_OFFSET[k]
+        inside = (targets >= 0) & (targets < len(x_values))
+        starts = np.stack((x_values[inside], np.full(inside.sum(), y_reference)), axis=1)
+        ends = np.stack((x_values[targets[inside]],
+                         np.full(inside.sum(), y_reference + NEIGHBOURS_Y_OFFSET[k] * y_step)), axis=1)
+        if len(starts) > 0:
+            table[inside, k] = haversine_array(starts, ends) * 1000  # in metres
+    return table
+
+
+def segment_lengths(xs, ys, step_lengths):
+    """
+    Length in metres of every move of one or many paths, read from the step length table
+    Moves between cells that are not neighbours (padding of the batched paths) get meaningless values
+    :param xs: x matrix coordinates, one path (points) or many padded paths (paths x points)
+    :param ys: y matrix coordinates, same shape of xs
+    :param step_lengths: table computed by step_length_table
+    :return: array with one element less in the last dimension
+    """
+    xs = np.asarray(xs, dtype=np.int64)
+    ys = np.asarray(ys, dtype=np.int64)
+    dx = np.clip(xs[..., 1:] - xs[..., :-1], -1, 1)
+    dy = np.clip(ys[..., 1:] - ys[..., :-1], -1, 1)
+    return step_lengths[xs[..., :-1], DIRECTION_OF_OFFSET[dx + 1, dy + 1]]
+
+
+def resample_path(distances, speeds):
+    """
+    Choose the points of the path that become the trajectory
+    Every timestep a speed is drawn and the path is followed until the space moved reaches it.
+    The first point is always part of the trajectory, the last move of the path is never used.
+    Moves longer than the speed are checked in blocks, searchsorted on the cumulative distances handles the others
+    :param distances: length in metres of every move of the path
+    :param speeds: space moved in every timestep, at least as many as the moves
+    :return: int32 array with the position in the path of every point of the trajectory
+    """
+    last = len(distances) - 1
+    indices = [np.zeros(1, dtype=np.int32)]
+    if last <= 0:
+        return indices[0]
+    cumulative = np.zeros(len(distances) + 1, dtype=np.float64)
+    np.cumsum(distances, out=cumulative[1:])
+
+    i = 0
+    k = 0
+    while i < last:
+        window = min(WINDOW, last - i)
+        # moves long enough for the speed of their timestep are taken one cell at a time
+        one_cell = distances[i:i + window] >= speeds[k:k + window]
+        run = window if one_cell.all() else int(np.argmin(one_cell))
+        indices.append(np.arange(i + 1, i + run + 1, dtype=np.int32))
+        i += run
+        k += run
+        if run < window:
+            # the speed needs more than one cell: first point whose distance reaches it
+            i = min(int(np.searchsorted(cumulative, cumulative[i] + speeds[k], side='left')), last)
+            k += 1
+            indices.append(np.array([i], dtype=np.int32))
+    return np.concatenate(indices)
+
+
+def resample_paths(distances, number_of_moves, speeds):
+    """
+    Batch version of resample_path working on padded paths
+    :param distances: length in metres of every move (paths x moves), padding is ignored
+    :param number_of_moves: how many moves every path has
+    :param speeds: space moved in every timestep (paths x moves)
+    :return: list with the positions in the path of the points of every trajectory
+    """
+    return [resample_path(distances=distances[i, :number_of_moves[i]], speeds=speeds[i])
+            for i in range(len(number_of_moves))]
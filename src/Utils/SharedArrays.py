@@ -0,0 +1,144 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import weakref
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # python < 3.8, the arrays are loaded by every process
+    shared_memory = None
+
+# segments attached by this process, kept open for its lifetime since the arrays read their memory
+_attached_segments = []
+
+
+def shared_memory_available():
+    return shared_memory is not None
+
+
+def is_memory_mapped(array):
+    """
+    Arrays memory mapped from a file are already shared by the processes through the page cache
+    :param array: numpy array
+    :return: True if the memory of the array comes from a file
+    """
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base if isinstance(array, np.ndarray) else None
+    return False
+
+
+def _release_segments(segments):
+    """
+    Close and remove the segments, called once by the registry (explicit close, garbage collection or exit)
+    :param segments: dict name -> SharedMemory
+    :return:
+    """
+    for segment in segments.values():
+        try:
+            segment.close()
+        except BufferError:
+            # arrays still pointing to the segment, it is closed with the process
+            pass
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+    segments.clear()
+
+
+class SharedArrayRegistry(object):
+    """
+    Numpy arrays published by the parent process in shared memory
+    The workers attach to them by name (see attach_shared_arrays) and read the same pages, without copies.
+    The segments are removed by close, when the registry is garbage collected or at exit. If the parent process is
+    killed the resource tracker of multiprocessing removes them
+    """
+
+    def __init__(self):
+        if shared_memory is None:
+            raise ValueError("Shared memory needs python 3.8 or newer")
+        self._segments = {}
+        self._arrays = {}
+        self._finalizer = weakref.finalize(self, _release_segments, self._segments)
+
+    def __contains__(self, name):
+        return name in self._arrays
+
+    def __getitem__(self, name):
+        return self._arrays[name]
+
+    def __len__(self):
+        return len(self._arrays)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self._arrays.values())
+
+    def publish(self, name, array):
+        """
+        Copy the array in a new shared memory segment
+        :param name: name the workers use to find the array
+        :param array: numpy array
+        :return: the array backed by the shared memory (read only)
+        """
+        if name in self._arrays:
+            raise ValueError("Array {} already published".format(name))
+        array = np.ascontiguousarray(array)
+        segment = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)
+        shared[...] = array
+        shared.flags.writeable = False
+        self._segments[name] = segment
+        self._arrays[name] = shared
+        return shared
+
+    def descriptors(self):
+        """
+        Picklable description of the published arrays, to send to the workers
+        :return: dict name -> (name of the segment, shape, dtype)
+        """
+        return {name: (self._segments[name].name, array.shape, array.dtype.str)
+                for name, array in self._arrays.items()}
+
+    def close(self):
+        """
+        Remove all the segments, the workers have to be stopped before
+        :return:
+        """
+        self._arrays.clear()
+        self._finalizer()
+
+
+def attach_shared_arrays(descriptors):
+    """
+    Attach to the arrays published by the parent process
+    :param descriptors: output of SharedArrayRegistry.descriptors
+    :return: dict name -> read only array
+    """
+    arrays = {}
+    for name, (segment_name, shape, dtype) in descriptors.items():
+        segment = shared_memory.SharedMemory(name=segment_name)
+        _attached_segments.append(segment)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+        array.flags.writeable = False
+        arrays[name] = array
+    return arrays
@@ -0,0 +1,85 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import numpy as np
+from shapely import geometry
+
+from src.Utils.Point import Point
+
+
+def _to_points(coordinates):
+    """
+    Convert a (points x 2) array into a list of points
+    :param coordinates: array of coordinates
+    :return: list of points
+    """
+    return [Point(x, y) for x, y in coordinates.tolist()]
+
+
+class Trajectory(object):
+    """
+    One generated trajectory stored as contiguous arrays
+    path_nodes: node ids of the path in the road graph (int32)
+    path: matrix coordinates of the path (int32, points x 2)
+    tra_indices: position in the path of every point of the resampled trajectory (int32)
+    real: longitude and latitude of every point of the resampled trajectory (float64, points x 2)
+    distances: distance to every tag of every point of the resampled trajectory (float64, points x tags)
+    A handful of arrays pickle much faster than lists of points when they come back from the workers
+    """
+    __slots__ = ['path_nodes', 'path', 'tra_indices', 'real', 'distances']
+
+    def __init__(self, path_nodes, path, tra_indices, real, distances):
+        self.path_nodes = np.asarray(path_nodes, dtype=np.int32)
+        self.path = np.asarray(path, dtype=np.int32).reshape(-1, 2)
+        self.tra_indices = np.asarray(tra_indices, dtype=np.int32)
+        self.real = np.asarray(real, dtype=np.float64).reshape(-1, 2)
+        self.distances = np.asarray(distances, dtype=np.float64)
+
+    def __getstate__(self):
+        return self.path_nodes, self.path, self.tra_indices, self.real, self.distances
+
+    def __setstate__(self, state):
+        self.path_nodes, self.path, self.tra_indices, self.real, self.distances = state
+
+    def __len__(self):
+        return len(self.tra_indices)
+
+    @property
+    def tra(self):
+        """
+        Matrix coordinates of the resampled trajectory
+        :return: int32 array (points x 2)
+        """
+        return self.path[self.tra_indices]
+
+    def path_points(self):
+        return _to_points(self.path)
+
+    def tra_points(self):
+        return _to_points(self.tra)
+
+    def real_points(self):
+        return _to_points(self.real)
+
+
+def to_real_points(coordinates):
+    """
+    Convert a (points x 2) array into a list of shapely points, same output of Point.to_real_point
+    :param coordinates: array of coordinates
+    :return: list of shapely points
+    """
+    return [geometry.Point(x, y) for x, y in coordinates.tolist()]
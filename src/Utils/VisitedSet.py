@@ -0,0 +1,131 @@
+"""
+TrajectoriesRandomWalk. Towards a human-like movements generator based on environmental features
+Copyright (C) 2020  Alessandro Zonta (a.zonta@vu.nl)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+EMPTY_KEY = -1
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class VisitedNodes(object):
+    """
+    Set of the nodes visited by one trajectory, nodes are the dense ids of the road graph
+    Every node has a stamp: a node is visited if its stamp is equal to the stamp of the current trajectory.
+    Starting a new trajectory only increases the current stamp, the array is cleared once every 65535 trajectories
+    """
+
+    def __init__(self, number_of_nodes):
+        self._stamps = np.zeros(number_of_nodes, dtype=np.uint16)
+        self._current = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Empty the set
+        :return:
+        """
+        if self._current == np.iinfo(np.uint16).max:
+            self._stamps[:] = 0
+            self._current = 0
+        self._current += 1
+
+    def __contains__(self, node):
+        return self._stamps[node] == self._current
+
+    def contains(self, nodes):
+        """
+        Check which nodes are already visited
+        :param nodes: array of node ids
+        :return: boolean array, True if the node is visited
+        """
+        return self._stamps[nodes] == self._current
+
+    def add(self, nodes):
+        """
+        Mark the nodes as visited
+        :param nodes: node id or array of node ids
+        :return:
+        """
+        self._stamps[nodes] = self._current
+
+
+class VisitedKeys(object):
+    """
+    Open addressing hash set of int64 keys working on arrays of keys at the same time.
+    Used when many trajectories share the same set: every walker stores its visited nodes
+    as walker * number_of_nodes + node
+    """
+
+    def __init__(self, expected_keys):
+        capacity = 1
+        while capacity < 2 * expected_keys:
+            capacity *= 2
+        self._mask = capacity - 1
+        self._shift = np.uint64(64 - capacity.bit_length() + 1)
+        self._table = np.full(capacity, EMPTY_KEY, dtype=np.int64)
+
+    def reset(self):
+        """
+        Empty the set keeping its capacity
+        :return:
+        """
+        self._table.fill(EMPTY_KEY)
+
+    def _slots(self, keys):
+        """
+        Fibonacci hashing of the keys
+        :param keys: int64 array of keys
+        :return: starting slot for every key
+        """
+        with np.errstate(over="ignore"):
+            hashed = keys.astype(np.uint64) * HASH_MULTIPLIER
+        return (hashed >> self._shift).astype(np.int64) & self._mask
+
+    def contains(self, keys):
+        """
+        Check which keys are already in the set
+        :param keys: int64 array of keys
+        :return: boolean array, True if the key is present
+        """
+        found = np.zeros(len(keys), dtype=bool)
+        slots = self._slots(keys)
+        pending = np.arange(len(keys))
+        while len(pending) > 0:
+            stored = self._table[slots[pending]]
+            hit = stored == keys[pending]
+            found[pending[hit]] = True
+            keep = ~hit & (stored != EMPTY_KEY)
+            pending = pending[keep]
+            slots[pending] = (slots[pending] + 1) & self._mask
+        return found
+
+    def add(self, keys):
+        """
+        Add the keys to the set. Keys have to be unique inside the array
+        :param keys: int64 array of keys
+        :return:
+        """
+        slots = self._slots(keys)
+        pending = np.arange(len(keys))
+        while len(pending) > 0:
+            stored = self._table[slots[pending]]
+            free = stored == EMPTY_KEY
+            # more than one key can claim the same slot, only the last write survives
+            self._table[slots[pending[free]]] = keys[pending[free]]
+            placed = self._table[slots[pending]] == keys[pending]
+            pending = pending[~placed]
+            slots[pending] = (slots[pending] + 1) & self._mask
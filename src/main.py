@@ -20,6 +20,7 @@ import os
 import sys
 
 from src.Experiment.Controller import Controller
+from src.Experiment.ExperimentGrid import load_grid
 from src.Loaders.Attractiveness import ForcedAttractiveness
 from src.Settings.args import args
 
@@ -54,13 +55,13 @@ if __name__ == '__main__':
     logger.info("-------------------------- loading data")
     a = Controller(path_apf=apf_path, name_exp=args.name_exp, log=logger)
     d = ForcedAttractiveness(log=logger)
+    grid = load_grid(name_file=args.grid, genomes=d.v)
+    logger.info("Running {} cells of the experiment grid".format(len(grid)))
+    a.precompute_charge_fields(genomes=grid.genomes, types_random_walk=grid.types_random_walk)
     logger.info("-------------------------- data loaded")
-    name_counter = 0
-    for vector in d.v:
-        logger.info("Testing {} vector".format(vector))
-        name = "generate_tra_per_force"
-        path = "{}/{}_version_{}/".format(args.output_path, name, name_counter)
-        args.name_exp = "{}_version_{}".format(name, name_counter)
+    cells = []
+    for name, cell in grid.cells():
+        path = "{}/{}/".format(args.output_path, name)
         try:
             os.mkdir(path)
         except OSError:
@@ -68,8 +69,9 @@ if __name__ == '__main__':
             logger.error("Folder already present")
         else:
             logger.info("Successfully created the directory %s " % path)
-            a.set_vector_data(vector_data=vector)
-            a.initialise_individual_and_run(save_path=path, how_many=args.n_tra_generated, debug=True,
-                                            random_seed=args.random_seed)
-
-        name_counter += 1
+            cells.append((path, cell))
+    try:
+        # one pool of workers serves all the cells
+        a.run_grid(cells=cells, how_many=args.n_tra_generated)
+    finally:
+        a.close()